@@ -1,7 +1,25 @@
+import os
+import sqlite3
 from langgraph.graph import StateGraph, END
+# Checkpointer persistente (paquete langgraph-checkpoint-sqlite); sin él el grafo corre sin reanudación
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    CHECKPOINTS_AVAILABLE = True
+except ImportError:
+    SqliteSaver = None
+    CHECKPOINTS_AVAILABLE = False
 from state import AgentState
 # Importamos los nodos. Nota: Ya no necesitamos configurator_node dentro del grafo
-from nodes import extraction_node, validation_node, optimizer_node
+from nodes import extraction_node, validation_node, optimizer_node, tournament_node
+from controller import MAX_ATTEMPTS
+
+# --- CONFIGURACIÓN ---
+# El estado se guarda tras cada nodo; un corte (crash, red, cerrar la GUI) se reanuda con main.resume(familia)
+CHECKPOINT_PATH = os.getenv("ACHILLES_CHECKPOINTS", "checkpoints.db")
+# Pasos máximos del grafo: hasta 4 nodos por intento (optimizar, torneo, extraer, validar) más margen.
+# Con ACHILLES_MAX_ATTEMPTS=0 (sin tope) el ciclo lo cortan los presupuestos del controlador, no LangGraph.
+UNCAPPED_RECURSION_LIMIT = 100000
+RECURSION_LIMIT = 4 * MAX_ATTEMPTS + 10 if MAX_ATTEMPTS > 0 else UNCAPPED_RECURSION_LIMIT
 
 # Definimos el flujo
 workflow = StateGraph(AgentState)
@@ -11,6 +29,7 @@ workflow = StateGraph(AgentState)
 workflow.add_node("extraer", extraction_node)
 workflow.add_node("validar", validation_node)
 workflow.add_node("optimizar", optimizer_node)
+workflow.add_node("torneo", tournament_node)
 
 # 2. Definir el Flujo (CAMBIO CLAVE)
 # En Batch Mode, los datos ya entran limpios. Empezamos directo extrayendo.
@@ -20,8 +39,8 @@ workflow.set_entry_point("extraer")
 workflow.add_edge("extraer", "validar")
 
 def decide_next(state):
-    # Si ya terminamos (is_final) o pasamos los intentos máximos, paramos.
-    if state["is_final"] or state["attempts"] >= 5: 
+    # validation_node ya consultó al controlador (objetivo, presupuesto, convergencia): solo leemos is_final
+    if state["is_final"]: 
         return "fin"
     return "reintentar"
 
@@ -31,7 +50,23 @@ workflow.add_conditional_edges(
     {"reintentar": "optimizar", "fin": END}
 )
 
-# Si optimizamos, volvemos a extraer para probar la nueva táctica
-workflow.add_edge("optimizar", "extraer")
+def decide_candidates(state):
+    # Modo población: si el Arquitecto dejó varias candidatas, primero compiten entre sí
+    if len(state.get("candidate_tactics") or []) > 1:
+        return "torneo"
+    return "extraer"
+
+# Si optimizamos, volvemos a extraer para probar la nueva táctica (la ganadora del torneo, si lo hubo)
+workflow.add_conditional_edges(
+    "optimizar",
+    decide_candidates,
+    {"torneo": "torneo", "extraer": "extraer"}
+)
+workflow.add_edge("torneo", "extraer")
+
+checkpointer = SqliteSaver(sqlite3.connect(CHECKPOINT_PATH, check_same_thread=False)) if CHECKPOINTS_AVAILABLE else None
+app = workflow.compile(checkpointer=checkpointer)
 
-app = workflow.compile()
\ No newline at end of file
+def run_config(run_id):
+    """Config de LangGraph para una ejecución: el run_id es el thread_id del checkpointer."""
+    return {"configurable": {"thread_id": run_id}, "recursion_limit": RECURSION_LIMIT}
\ No newline at end of file
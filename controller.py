@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- CONFIGURACIÓN ---
+# Límites por familia (0 = sin límite). El ciclo se detiene al agotar cualquiera de ellos.
+TARGET_SCORE = float(os.getenv("ACHILLES_TARGET_SCORE", "98"))
+MAX_ATTEMPTS = int(os.getenv("ACHILLES_MAX_ATTEMPTS", "5"))   # Mismo tope que el corte fijo anterior; súbelo para dejar decidir a presupuestos y convergencia
+MAX_API_CALLS = int(os.getenv("ACHILLES_MAX_API_CALLS", "0"))
+MAX_TOKENS = int(os.getenv("ACHILLES_MAX_TOKENS", "0"))
+MAX_MINUTES = float(os.getenv("ACHILLES_MAX_MINUTES", "0"))
+MAX_COST_USD = float(os.getenv("ACHILLES_MAX_COST_USD", "0"))
+# Precios del modelo (USD por millón de tokens) para estimar el costo
+PRICE_INPUT_PER_MTOK = float(os.getenv("ACHILLES_PRICE_INPUT_PER_MTOK", "0"))
+PRICE_OUTPUT_PER_MTOK = float(os.getenv("ACHILLES_PRICE_OUTPUT_PER_MTOK", "0"))
+# Tokens de entrada servidos desde la caché de prefijo del proveedor (suelen cobrarse con descuento)
+PRICE_CACHED_INPUT_PER_MTOK = float(os.getenv("ACHILLES_PRICE_CACHED_INPUT_PER_MTOK", str(PRICE_INPUT_PER_MTOK)))
+
+# --- CONVERGENCIA ---
+# Si en los últimos CONVERGENCE_WINDOW intentos el mejor score subió menos de MIN_GAIN_PER_PASS puntos
+# por cada pasada completa del lote (llamadas / casos), seguir gastando no compensa y la familia se da por convergida.
+# Se mide por pasada y no por llamada: así el umbral significa lo mismo para un lote de 5 casos que para uno de 400.
+CONVERGENCE_WINDOW = 3
+MIN_GAIN_PER_PASS = float(os.getenv("ACHILLES_MIN_GAIN_PER_PASS", "1.0"))
+
+def cached_prompt_tokens(usage):
+    """usage.prompt_tokens_details.cached_tokens si el proveedor lo informa (objeto o dict), si no 0."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict): return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+class UsageMeter:
+    """
+    Contador de consumo de un nodo: llamadas reales a la API y tokens de su 'usage'.
+    Los aciertos de caché (from_cache) no cuentan: no cuestan nada. Seguro entre hilos.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, response):
+        if getattr(response, "from_cache", False): return
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+            self.cached_prompt_tokens += cached_prompt_tokens(usage)
+
+    def cost(self):
+        fresh = self.prompt_tokens - self.cached_prompt_tokens
+        return (
+            fresh * PRICE_INPUT_PER_MTOK
+            + self.cached_prompt_tokens * PRICE_CACHED_INPUT_PER_MTOK
+            + self.completion_tokens * PRICE_OUTPUT_PER_MTOK
+        ) / 1_000_000
+
+    def state_update(self, state):
+        """Acumula este consumo sobre los totales del estado del grafo."""
+        return {
+            "api_calls": state.get("api_calls", 0) + self.calls,
+            "tokens_used": state.get("tokens_used", 0) + self.prompt_tokens + self.completion_tokens,
+            "cost_usd": state.get("cost_usd", 0.0) + self.cost(),
+            "cached_prompt_tokens": state.get("cached_prompt_tokens", 0) + self.cached_prompt_tokens,
+        }
+
+class LoopController:
+    """
+    CONTROLADOR DEL CICLO:
+    Decide tras cada validación si la familia sigue optimizando. Reemplaza el corte fijo de 5 intentos:
+    para por objetivo alcanzado, por presupuesto agotado (llamadas, tokens, tiempo, costo) o porque
+    la ganancia esperada por llamada ya no justifica el gasto.
+    """
+    def __init__(self, target_score=TARGET_SCORE, max_attempts=MAX_ATTEMPTS, max_api_calls=MAX_API_CALLS,
+                 max_tokens=MAX_TOKENS, max_minutes=MAX_MINUTES, max_cost_usd=MAX_COST_USD,
+                 window=CONVERGENCE_WINDOW, min_gain_per_pass=MIN_GAIN_PER_PASS):
+        self.target_score = target_score
+        self.max_attempts = max_attempts
+        self.max_api_calls = max_api_calls
+        self.max_tokens = max_tokens
+        self.max_minutes = max_minutes
+        self.max_cost_usd = max_cost_usd
+        self.window = window
+        self.min_gain_per_pass = min_gain_per_pass
+
+    @staticmethod
+    def history_entry(state, avg_score, best_avg, partial):
+        """Foto del intento recién validado para score_history."""
+        return {
+            "attempt": state.get("attempts", 0),
+            "score": round(avg_score, 3),
+            "best": round(best_avg, 3),
+            "partial": partial,
+            "api_calls": state.get("api_calls", 0),
+            "tokens": state.get("tokens_used", 0),
+        }
+
+    def gain_per_pass(self, history, batch_size):
+        """Subida del mejor score por pasada completa del lote en la ventana reciente (None si aún no hay datos)."""
+        if len(history) <= self.window or not batch_size: return None
+        start, end = history[-1 - self.window], history[-1]
+        calls = end["api_calls"] - start["api_calls"]
+        # Intentos servidos desde caché no gastan: no hay base para juzgar el rendimiento
+        if calls <= 0: return None
+        return (end["best"] - start["best"]) * batch_size / calls
+
+    def decide(self, state):
+        """Retorna (parar, motivo). state ya incluye score_history y los contadores del intento actual."""
+        history = state.get("score_history", [])
+        last = history[-1] if history else None
+
+        if last and not last["partial"] and last["score"] >= self.target_score:
+            return True, f"objetivo alcanzado ({last['score']:.1f}% ≥ {self.target_score:.0f}%)"
+        if self.max_api_calls and state.get("api_calls", 0) >= self.max_api_calls:
+            return True, f"presupuesto de llamadas agotado ({state['api_calls']}/{self.max_api_calls})"
+        if self.max_tokens and state.get("tokens_used", 0) >= self.max_tokens:
+            return True, f"presupuesto de tokens agotado ({state['tokens_used']}/{self.max_tokens})"
+        if self.max_cost_usd and state.get("cost_usd", 0.0) >= self.max_cost_usd:
+            return True, f"presupuesto de costo agotado (${state['cost_usd']:.2f}/${self.max_cost_usd:.2f})"
+        if self.max_minutes and state.get("started_at"):
+            minutes = (time.time() - state["started_at"]) / 60
+            if minutes >= self.max_minutes:
+                return True, f"tiempo agotado ({minutes:.0f}/{self.max_minutes:.0f} min)"
+        if self.max_attempts and state.get("attempts", 0) >= self.max_attempts:
+            return True, f"tope de seguridad de {self.max_attempts} intentos"
+
+        gain = self.gain_per_pass(history, len(state.get("batch_queue", [])))
+        if gain is not None and gain < self.min_gain_per_pass:
+            return True, f"convergencia: +{gain:.2f} pts por pasada del lote en los últimos {self.window} intentos"
+        return False, ""
+
+# Instancia global (los límites vienen del .env)
+loop_controller = LoopController()
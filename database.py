@@ -1,28 +1,45 @@
 import sqlite3
 import json
+import threading
+import hashlib
+import time
 
 class AgentMemory:
     def __init__(self):
         # check_same_thread=False permite que LangGraph/Streamlit accedan a la DB desde distintos hilos sin crashear
         self.conn = sqlite3.connect("agent_memory.db", check_same_thread=False)
+        # Varias familias pueden correr en paralelo: serializamos el acceso a la conexión compartida
+        self.lock = threading.RLock()
         self._init_db()
 
     def _init_db(self):
-        self.conn.execute("CREATE TABLE IF NOT EXISTS success_tactics (family TEXT, tactic TEXT, score REAL)")
-        # CAMBIO: Cambiamos doc_id por family
-        self.conn.execute("CREATE TABLE IF NOT EXISTS failed_tactics (family TEXT, tactic TEXT, errors TEXT)")
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS success_tactics (family TEXT, tactic TEXT, score REAL)")
+            # CAMBIO: Cambiamos doc_id por family
+            self.conn.execute("CREATE TABLE IF NOT EXISTS failed_tactics (family TEXT, tactic TEXT, errors TEXT)")
+            # Memo del Configurador: ground truth ya parseado, indexado por hash del texto crudo
+            self.conn.execute("CREATE TABLE IF NOT EXISTS parsed_truths (truth_hash TEXT PRIMARY KEY, source TEXT, expected_data TEXT, rules TEXT)")
+            # Ejecuciones del grafo (thread_id del checkpointer) para poder reanudarlas
+            self.conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, family TEXT, status TEXT, started_at REAL, updated_at REAL)")
+            # Extracciones ya pagadas dentro de un intento en curso (se reutilizan al reanudar)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS case_checkpoints (run_id TEXT, attempt INTEGER, tactic_hash TEXT, case_id TEXT, extraction TEXT, "
+                "PRIMARY KEY (run_id, attempt, case_id))"
+            )
+            # Familia de cada caso, registrada al agregarlo (el nombre del archivo es ambiguo si la familia lleva "_")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS case_families (case_id TEXT PRIMARY KEY, family TEXT)")
+            self.conn.commit()
 
     def get_best_tactic(self, family):
         """
         Busca la mejor táctica histórica para esta familia documental.
         Retorna: La táctica (str) O None si no existe historial.
         """
-        cursor = self.conn.cursor()
-        res = cursor.execute(
-            "SELECT tactic FROM success_tactics WHERE family = ? ORDER BY score DESC LIMIT 1", 
-            (family,)
-        ).fetchone()
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT tactic FROM success_tactics WHERE family = ? ORDER BY score DESC LIMIT 1", 
+                (family,)
+            ).fetchone()
         
         # --- CORRECCIÓN CRÍTICA ---
         # Antes devolvía un string por defecto, lo que engañaba al main.py.
@@ -30,26 +47,29 @@ class AgentMemory:
         return res[0] if res else None
 
     def save_success(self, family, tactic, score):
-        self.conn.execute(
-            "INSERT INTO success_tactics (family, tactic, score) VALUES (?, ?, ?)", 
-            (family, tactic, score)
-        )
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO success_tactics (family, tactic, score) VALUES (?, ?, ?)", 
+                (family, tactic, score)
+            )
+            self.conn.commit()
 
     # Ajusta los métodos para usar 'family'
     def save_failure(self, family, tactic, errors):
-        self.conn.execute(
-            "INSERT INTO failed_tactics (family, tactic, errors) VALUES (?, ?, ?)", 
-            (family, tactic, json.dumps(errors))
-        )
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO failed_tactics (family, tactic, errors) VALUES (?, ?, ?)", 
+                (family, tactic, json.dumps(errors))
+            )
+            self.conn.commit()
     
     def get_recent_failures(self, family):
         """Recupera las tácticas tóxicas de TODA la familia."""
-        res = self.conn.execute(
-            "SELECT tactic FROM failed_tactics WHERE family = ? ORDER BY rowid DESC LIMIT 5", 
-            (family,)
-        ).fetchall()
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT tactic FROM failed_tactics WHERE family = ? ORDER BY rowid DESC LIMIT 5", 
+                (family,)
+            ).fetchall()
         return [r[0] for r in res]
 
     def clear_family_memory(self, family):
@@ -57,6 +77,88 @@ class AgentMemory:
         UTILIDAD: Úsala si guardaste basura por error en una familia.
         Ej: db.clear_family_memory("6496")
         """
-        self.conn.execute("DELETE FROM success_tactics WHERE family = ?", (family,))
-        self.conn.commit()
-        print(f"🧹 Memoria borrada para la familia: {family}")
\ No newline at end of file
+        with self.lock:
+            self.conn.execute("DELETE FROM success_tactics WHERE family = ?", (family,))
+            self.conn.commit()
+        print(f"🧹 Memoria borrada para la familia: {family}")
+
+    def get_parsed_truth(self, truth_hash):
+        """Devuelve {"expected_data", "rules"} si este texto exacto ya fue parseado, o None."""
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT expected_data, rules FROM parsed_truths WHERE truth_hash = ?", 
+                (truth_hash,)
+            ).fetchone()
+        return {"expected_data": json.loads(res[0]), "rules": json.loads(res[1])} if res else None
+
+    def save_parsed_truth(self, source, truth_hash, expected_data, rules):
+        """
+        Guarda el parseo de un archivo de verdad. Si el archivo (source) cambió,
+        la entrada anterior de ese mismo archivo se invalida.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM parsed_truths WHERE source = ? AND truth_hash != ?", (source, truth_hash))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO parsed_truths (truth_hash, source, expected_data, rules) VALUES (?, ?, ?, ?)", 
+                (truth_hash, source, json.dumps(expected_data), json.dumps(rules))
+            )
+            self.conn.commit()
+
+    # --- EJECUCIONES Y CHECKPOINTS POR CASO ---
+    def start_run(self, run_id, family):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, family, status, started_at, updated_at) VALUES (?, ?, 'running', ?, ?)", 
+                (run_id, family, now, now)
+            )
+            self.conn.commit()
+
+    def finish_run(self, run_id, status):
+        """status: 'done' (ya no se reanuda) o 'error' (reanudable). Al terminar bien se borran sus checkpoints por caso."""
+        with self.lock:
+            self.conn.execute("UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?", (status, time.time(), run_id))
+            if status == "done": self.conn.execute("DELETE FROM case_checkpoints WHERE run_id = ?", (run_id,))
+            self.conn.commit()
+
+    def get_resumable_run(self, family):
+        """Última ejecución de la familia que no terminó (cortada o con error), o None."""
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT run_id FROM runs WHERE family = ? AND status IN ('running', 'error') ORDER BY started_at DESC LIMIT 1", 
+                (family,)
+            ).fetchone()
+        return res[0] if res else None
+
+    @staticmethod
+    def _tactic_hash(tactic):
+        return hashlib.sha256((tactic or "").encode("utf-8")).hexdigest()
+
+    def save_case_result(self, run_id, attempt, tactic, case_id, extraction):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO case_checkpoints (run_id, attempt, tactic_hash, case_id, extraction) VALUES (?, ?, ?, ?, ?)", 
+                (run_id, attempt, self._tactic_hash(tactic), case_id, json.dumps(extraction))
+            )
+            self.conn.commit()
+
+    def get_case_results(self, run_id, attempt, tactic):
+        """{ case_id: extracción } ya completados en este intento con esta misma táctica."""
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT case_id, extraction FROM case_checkpoints WHERE run_id = ? AND attempt = ? AND tactic_hash = ?", 
+                (run_id, attempt, self._tactic_hash(tactic))
+            ).fetchall()
+        return {r[0]: json.loads(r[1]) for r in res}
+
+    # --- REGISTRO DE CASOS POR FAMILIA ---
+    def register_case(self, case_id, family):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO case_families (case_id, family) VALUES (?, ?)", (case_id, family))
+            self.conn.commit()
+
+    def get_case_families(self):
+        """{ case_id: familia } de todos los casos registrados."""
+        with self.lock:
+            res = self.conn.execute("SELECT case_id, family FROM case_families").fetchall()
+        return dict(res)
@@ -3,6 +3,7 @@ import json
 import re
 from fireworks.client import Fireworks
 from dotenv import load_dotenv
+from llm_cache import cached_completion
 import os
 
 load_dotenv()
@@ -53,7 +54,8 @@ def auto_generate_prompt_from_image(image_path, expected_data):
             {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}}
         ]
 
-        response = client.chat.completions.create(
+        response = cached_completion(
+            client,
             model=MODEL, 
             messages=[{"role": "user", "content": content}], 
             temperature=0.0
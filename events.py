@@ -0,0 +1,52 @@
+import queue
+import threading
+import time
+
+# --- CONFIGURACIÓN ---
+# Eventos retenidos por suscriptor si nadie los consume; al llenarse se descartan (el emisor nunca se bloquea)
+MAX_PENDING_EVENTS = 50000
+
+class EventBus:
+    """
+    BUS DE EVENTOS (pub/sub):
+    Los nodos y el runner publican eventos estructurados { "kind", "ts", ... } y cada suscriptor
+    los recibe en su propia cola. publish() nunca bloquea: es seguro desde cualquier hilo.
+    Tipos usados: "log" (texto de print), "node" (paso del grafo), "case" (caso validado), "attempt" (intento validado).
+    """
+    def __init__(self, max_pending=MAX_PENDING_EVENTS):
+        self.max_pending = max_pending
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_pending)
+        with self._lock: self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            if q in self._subscribers: self._subscribers.remove(q)
+
+    def publish(self, kind, **data):
+        with self._lock: subscribers = list(self._subscribers)
+        if not subscribers: return
+        event = {"kind": kind, "ts": time.time(), **data}
+        for q in subscribers:
+            try: q.put_nowait(event)
+            except queue.Full: self.dropped += 1
+
+class QueueWriter:
+    """Reemplazo de sys.stdout/sys.stderr: cada write se publica como evento "log" (no toca ningún widget)."""
+    def __init__(self, bus=None, stream="stdout"):
+        self.bus = bus if bus is not None else event_bus
+        self.stream = stream
+
+    def write(self, text):
+        if text: self.bus.publish("log", text=text, stream=self.stream)
+        return len(text)
+
+    def flush(self): pass
+
+# Instancia global compartida por nodos, runner y GUI
+event_bus = EventBus()
@@ -1,7 +1,9 @@
 import customtkinter as ctk
 import threading
+import multiprocessing
 import sys
 import os
+import queue
 import shutil
 import time
 from pathlib import Path
@@ -9,6 +11,7 @@ from tkinter import filedialog, messagebox
 import main 
 import nodes 
 import detective 
+from events import event_bus, QueueWriter
 
 # Intentamos importar Drag & Drop
 try:
@@ -26,17 +29,11 @@ except ImportError:
 ctk.set_appearance_mode("Dark") 
 ctk.set_default_color_theme("green") 
 
-class TextRedirector(object):
-    def __init__(self, widget):
-        self.widget = widget
-    def write(self, str):
-        try:
-            self.widget.configure(state="normal")
-            self.widget.insert("end", str)
-            self.widget.see("end") 
-            self.widget.configure(state="disabled")
-        except: pass
-    def flush(self): pass
+# --- LOG EN PANTALLA ---
+# El worker solo publica eventos; la GUI los vacía por lotes con after() y guarda las últimas N líneas
+LOG_MAX_LINES = 3000
+LOG_PUMP_MS = 100
+LOG_EVENTS_PER_TICK = 2000
 
 class TextEditorDialog(ctk.CTkToplevel):
     def __init__(self, parent, title, initial_text=""):
@@ -139,14 +136,56 @@ class AchillesApp(AchillesBase):
 
         # 9. LOGS
         ctk.CTkLabel(self, text="Registro de Auditoría:", text_color="gray").grid(row=8, column=0, padx=20, sticky="w", pady=(10,0))
+        self.lbl_progress = ctk.CTkLabel(self, text="", text_color="#2CC985", anchor="e")
+        self.lbl_progress.grid(row=8, column=1, columnspan=2, padx=20, sticky="e", pady=(10,0))
         self.textbox_log = ctk.CTkTextbox(self, font=("Consolas", 10), text_color="#E0E0E0", fg_color="#1A1A1A")
         self.textbox_log.grid(row=9, column=0, columnspan=3, padx=20, pady=(0, 20), sticky="nsew")
+        self.textbox_log.configure(state="disabled")
         
-        sys.stdout = TextRedirector(self.textbox_log)
-        sys.stderr = TextRedirector(self.textbox_log)
+        # Los print de cualquier hilo van a la cola de eventos; solo el hilo de Tk toca el widget
+        self.event_queue = event_bus.subscribe()
+        sys.stdout = QueueWriter(stream="stdout")
+        sys.stderr = QueueWriter(stream="stderr")
+        self.after(LOG_PUMP_MS, self.pump_events)
 
         self.cleanup_temp_files()
 
+    # --- BOMBA DE EVENTOS (hilo de Tk) ---
+    def pump_events(self):
+        """Vacía la cola de eventos en lotes: un solo insert por tick, sin importar cuántos print hubo."""
+        chunks, progress = [], None
+        try:
+            for _ in range(LOG_EVENTS_PER_TICK):
+                event = self.event_queue.get_nowait()
+                if event["kind"] == "log": chunks.append(event["text"])
+                else: progress = event
+        except queue.Empty: pass
+        if chunks: self.append_log("".join(chunks))
+        if progress: self.show_progress(progress)
+        self.after(LOG_PUMP_MS, self.pump_events)
+
+    def append_log(self, text):
+        self.textbox_log.configure(state="normal")
+        self.textbox_log.insert("end", text)
+        # Ring buffer: solo se conservan las últimas LOG_MAX_LINES líneas en pantalla
+        lines = int(self.textbox_log.index("end-1c").split(".")[0])
+        if lines > LOG_MAX_LINES: self.textbox_log.delete("1.0", f"{lines - LOG_MAX_LINES + 1}.0")
+        self.textbox_log.see("end")
+        self.textbox_log.configure(state="disabled")
+
+    def show_progress(self, event):
+        kind = event["kind"]
+        if kind == "case":
+            tag = f"{event['tag']} " if event.get("tag") else ""
+            text = f"{tag}{event['done']}/{event['total']} casos · promedio parcial {event['running_avg']:.1f}%"
+        elif kind == "attempt":
+            text = f"Intento {event['attempt']}: {event['avg_score']:.1f}% (mejor {event['best_avg_score']:.1f}%) · {event['api_calls']} llamadas"
+            if event.get("is_final"): text += f" · fin: {event['stop_reason']}"
+        elif kind == "node":
+            text = f"Paso: {event['node']}"
+        else: return
+        self.lbl_progress.configure(text=text)
+
     def reset_session(self):
         """Elimina todos los archivos cargados para empezar de cero."""
         if not messagebox.askyesno("Confirmar Limpieza", "¿Seguro que quieres borrar todos los documentos cargados y empezar una nueva sesión?"):
@@ -271,6 +310,7 @@ class AchillesApp(AchillesBase):
             os.makedirs(main.DOCS_DIR, exist_ok=True)
             shutil.copy(pdf, main.DOCS_DIR / f"{case_id}{Path(pdf).suffix}")
             shutil.copy(exp, main.DOCS_DIR / f"expected_{case_id}.txt")
+            main.db.register_case(case_id, fam)
             print(f"✅ Agregado: {case_id}")
             self.clear_input("pdf_path", self.lbl_pdf_path)
             self.clear_input("expected_path", self.lbl_expected_path)
@@ -288,6 +328,7 @@ class AchillesApp(AchillesBase):
         threading.Thread(target=self.run_logic, args=(api, fam), daemon=True).start()
 
     def run_logic(self, api_key, family):
+        confirm = None
         try:
             print(f"\n{'='*40}\n🚀 ACHILLES BATCH: {family.upper()}\n{'='*40}")
             nodes.client.api_key = api_key; detective.client.api_key = api_key
@@ -334,30 +375,44 @@ class AchillesApp(AchillesBase):
 
                 final_content = nodes.syntax_enforcer_agent(raw_content, expected_keys)
                 
-                print(f"\n✋ VALIDACIÓN REQUERIDA.")
-                should_save = messagebox.askyesno(
-                    "Validación de Resultados", 
-                    f"El proceso finalizó con un Score Promedio de {score:.1f}%.\n\n"
-                    f"¿Deseas SOBRESCRIBIR el Prompt Maestro actual con esta nueva versión optimizada?"
-                )
-                
-                if should_save:
-                    with open(dest_master, "w", encoding="utf-8") as f:
-                        f.write(final_content)
-                    print(f"✅ GUARDADO. Score: {score:.1f}%")
-                    messagebox.showinfo("Éxito", "Prompt Maestro actualizado correctamente.")
-                else:
-                    print(f"🚫 Guardado cancelado por el usuario. Se mantiene la versión anterior.")
-                    messagebox.showinfo("Cancelado", "No se realizaron cambios en el Prompt Maestro.")
+                # Diálogos y guardado van al hilo de Tk (confirm_master_save cierra la corrida al terminar)
+                confirm = (dest_master, score, final_content)
 
             else: 
                 print("❌ Sin resultados.")
         except Exception as e: print(f"❌ Error: {e}"); import traceback; traceback.print_exc()
         finally: 
-            self.btn_run.configure(state="normal", text="▶️ EJECUTAR")
-            self.update_batch_status()
+            # De vuelta al hilo de Tk para tocar widgets
+            if confirm: self.after(0, self.confirm_master_save, *confirm)
+            else: self.after(0, self.finish_run_ui)
+
+    def confirm_master_save(self, dest_master, score, final_content):
+        try:
+            print(f"\n✋ VALIDACIÓN REQUERIDA.")
+            should_save = messagebox.askyesno(
+                "Validación de Resultados", 
+                f"El proceso finalizó con un Score Promedio de {score:.1f}%.\n\n"
+                f"¿Deseas SOBRESCRIBIR el Prompt Maestro actual con esta nueva versión optimizada?"
+            )
+            
+            if should_save:
+                with open(dest_master, "w", encoding="utf-8") as f:
+                    f.write(final_content)
+                print(f"✅ GUARDADO. Score: {score:.1f}%")
+                messagebox.showinfo("Éxito", "Prompt Maestro actualizado correctamente.")
+            else:
+                print(f"🚫 Guardado cancelado por el usuario. Se mantiene la versión anterior.")
+                messagebox.showinfo("Cancelado", "No se realizaron cambios en el Prompt Maestro.")
+        except Exception as e: print(f"❌ Error: {e}"); messagebox.showerror("Error", str(e))
+        finally: self.finish_run_ui()
+
+    def finish_run_ui(self):
+        self.btn_run.configure(state="normal", text="▶️ EJECUTAR")
+        self.update_batch_status()
 
 if __name__ == "__main__":
+    # Necesario para el pool de rasterizado cuando la app se empaqueta con PyInstaller
+    multiprocessing.freeze_support()
     if not os.path.exists("casos_docs"): os.makedirs("casos_docs")
     if not os.path.exists("prompt_textos"): os.makedirs("prompt_textos")
     app = AchillesApp()
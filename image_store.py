@@ -0,0 +1,78 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+# --- CONFIGURACIÓN ---
+# Tope de memoria para las imágenes ya codificadas; lo que no cabe se vuelca a disco.
+MAX_MEMORY_BYTES = int(float(os.getenv("ACHILLES_IMAGE_STORE_MB", "512")) * 1024 * 1024)
+
+class ImageStore:
+    """
+    ALMACÉN DE IMÁGENES CODIFICADAS:
+    Cada imagen se lee y se pasa a base64 UNA sola vez por ejecución.
+    Las entradas se indexan por el sha256 de sus bytes y se guardan ya como parte 'image_url'
+    lista para el mensaje, así el bucle de extracción solo referencia objetos preparados.
+    """
+    def __init__(self, max_memory_bytes=MAX_MEMORY_BYTES):
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_bytes = 0
+        self._parts = {}      # digest -> parte image_url (en memoria)
+        self._spilled = {}    # digest -> ruta del .b64 volcado a disco
+        self._refs = {}       # digest -> número de casos que la usan
+        self._spill_dir = None
+        self._lock = threading.Lock()
+
+    def add_bytes(self, data, mime="image/jpeg"):
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+            if digest in self._parts or digest in self._spilled:
+                return digest
+            url = f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+            if self.memory_bytes + len(url) <= self.max_memory_bytes:
+                self._parts[digest] = {"type": "image_url", "image_url": {"url": url}}
+                self.memory_bytes += len(url)
+            else:
+                if not self._spill_dir: self._spill_dir = tempfile.mkdtemp(prefix="achilles_img_")
+                path = os.path.join(self._spill_dir, f"{digest}.b64")
+                with open(path, "w", encoding="ascii") as f: f.write(url)
+                self._spilled[digest] = path
+        return digest
+
+    def add_file(self, path, mime="image/jpeg"):
+        with open(path, "rb") as f:
+            return self.add_bytes(f.read(), mime=mime)
+
+    def part(self, digest):
+        """Devuelve la parte 'image_url' lista para insertar en el contenido del mensaje."""
+        cached = self._parts.get(digest)
+        if cached is not None: return cached
+        path = self._spilled.get(digest)
+        if path is None: raise KeyError(f"Imagen no registrada: {digest}")
+        with open(path, "r", encoding="ascii") as f:
+            return {"type": "image_url", "image_url": {"url": f.read()}}
+
+    def release(self, digests):
+        """Libera las imágenes de un lote cuando ningún caso las sigue usando."""
+        with self._lock:
+            for digest in digests:
+                refs = self._refs.get(digest, 0) - 1
+                if refs > 0:
+                    self._refs[digest] = refs
+                    continue
+                self._refs.pop(digest, None)
+                part = self._parts.pop(digest, None)
+                if part: self.memory_bytes -= len(part["image_url"]["url"])
+                path = self._spilled.pop(digest, None)
+                if path:
+                    try: os.remove(path)
+                    except OSError: pass
+            if not self._parts and not self._spilled and self._spill_dir:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+# Instancia global: los nodos la consultan por digest
+image_store = ImageStore()
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from throttle import api_budget
+from telemetry import telemetry
+from controller import cached_prompt_tokens
+
+load_dotenv()
+
+# --- CONFIGURACIÓN ---
+CACHE_PATH = os.getenv("ACHILLES_LLM_CACHE", "llm_cache.db")
+CACHE_MAX_BYTES = int(float(os.getenv("ACHILLES_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+CACHE_TTL_SECONDS = float(os.getenv("ACHILLES_LLM_CACHE_TTL_HOURS", "168")) * 3600
+CACHE_BYPASS = os.getenv("ACHILLES_LLM_CACHE_BYPASS", "0") == "1"
+
+_DATA_URL = re.compile(r"^data:[^;,]+;base64,")
+
+def _digest_images(obj):
+    """Sustituye cada imagen base64 por su huella sha256 (la clave no arrastra megas de texto)."""
+    if isinstance(obj, dict):
+        return {k: _digest_images(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_digest_images(v) for v in obj]
+    if isinstance(obj, str) and _DATA_URL.match(obj):
+        return "sha256:" + hashlib.sha256(obj.encode("utf-8")).hexdigest()
+    return obj
+
+def _request_bytes(messages):
+    """Bytes de texto e imágenes (data URLs) que viajan en los mensajes."""
+    total = 0
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content.encode("utf-8"))
+            continue
+        for part in content or []:
+            if part.get("type") == "text": total += len(part.get("text", "").encode("utf-8"))
+            elif part.get("type") == "image_url": total += len(part.get("image_url", {}).get("url", ""))
+    return total
+
+def cache_key(**request):
+    """
+    Huella de la petición completa: modelo, mensajes, imágenes, temperatura, response_format...
+    Cualquier byte distinto en la petición genera otra clave.
+    """
+    payload = json.dumps(_digest_images(request), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SQLiteCacheBackend:
+    """
+    Almacén por defecto (SQLite en disco). Cualquier objeto con get/put/delete/evict_to
+    puede reemplazarlo en ResponseCache.
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, payload TEXT, size INTEGER, created REAL, last_access REAL)")
+            self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT payload, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key, payload):
+        raw = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, len(raw.encode("utf-8")), now, now)
+            )
+            self.conn.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def evict_to(self, max_bytes):
+        """Desaloja las entradas menos usadas (LRU) hasta quedar bajo el tope de bytes."""
+        with self.lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= max_bytes: return 0
+            evicted = 0
+            for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+                if total <= max_bytes: break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+            self.conn.commit()
+            return evicted
+
+class ResponseCache:
+    def __init__(self, backend=None, max_bytes=CACHE_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS, bypass=CACHE_BYPASS):
+        self.backend = backend if backend is not None else SQLiteCacheBackend()
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bypass = bypass
+
+    def get(self, key):
+        hit = self.backend.get(key)
+        if not hit: return None
+        payload, created = hit
+        if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+            self.backend.delete(key)
+            return None
+        return payload
+
+    def put(self, key, payload):
+        self.backend.put(key, payload)
+        if self.max_bytes: self.backend.evict_to(self.max_bytes)
+
+def _to_payload(response):
+    usage = getattr(response, "usage", None)
+    return {
+        "content": response.choices[0].message.content,
+        "usage": {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+        }
+    }
+
+def _as_response(payload):
+    """Reconstruye un objeto con la misma forma que la respuesta de Fireworks."""
+    message = SimpleNamespace(content=payload.get("content"))
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message)],
+        usage=SimpleNamespace(**payload.get("usage", {})),
+        from_cache=True
+    )
+
+# Instancia global compartida por todos los puntos de llamada
+response_cache = ResponseCache()
+
+def cached_completion(client, throttle=api_budget, bypass=False, meter=None, **request):
+    """
+    Reemplazo de client.chat.completions.create con caché por contenido.
+    Los aciertos de caché no consumen presupuesto de API (throttle). Por defecto todas las
+    llamadas comparten el presupuesto global, incluso entre familias en paralelo.
+    meter (controller.UsageMeter) acumula llamadas y tokens; ignora por sí mismo los aciertos de caché.
+    """
+    key = cache_key(**request)
+    if not (bypass or response_cache.bypass):
+        payload = response_cache.get(key)
+        if payload is not None:
+            telemetry.count("llm_cache_hits")
+            response = _as_response(payload)
+            if meter is not None: meter.add(response)
+            return response
+
+    telemetry.count("llm_request_bytes", _request_bytes(request.get("messages")))
+    with telemetry.span("llm_call"):
+        if throttle is not None:
+            response = throttle.call(client.chat.completions.create, **request)
+        else:
+            response = client.chat.completions.create(**request)
+    if meter is not None: meter.add(response)
+    usage = getattr(response, "usage", None)
+    telemetry.count("llm_calls")
+    telemetry.count("llm_prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+    telemetry.count("llm_completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+    telemetry.count("llm_cached_prompt_tokens", cached_prompt_tokens(usage))
+
+    try: response_cache.put(key, _to_payload(response))
+    except Exception as e: print(f"      ⚠️ No se pudo guardar en caché LLM: {e}")
+    return response
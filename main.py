@@ -1,107 +1,84 @@
 import os
-import fitz  # PyMuPDF
-import shutil
+import json
+import hashlib
+import time
+from datetime import datetime
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from app import app
+from app import app, run_config, CHECKPOINTS_AVAILABLE
 from database import AgentMemory
 # Importamos las herramientas para el modo "Detective"
 from detective import auto_generate_prompt_from_image 
 from nodes import configurator_node 
+from image_store import image_store
+from score_matrix import ScoreMatrix
+from events import event_bus
+from telemetry import telemetry
+# El rasterizado vive en su propio módulo para poder ejecutarse en procesos hijos
+from rasterizer import render_document, rasterize_batch
 
 # --- CONFIGURACIÓN ---
 BASE_DIR = Path(os.getcwd())
 DOCS_DIR = BASE_DIR / "casos_docs"
 PROMPTS_DIR = BASE_DIR / "prompt_textos"
 
+REPORTS_DIR = BASE_DIR / "reportes"
+
 # Si supera este límite, activa el Smart Pruning
 MAX_PAGES_BEFORE_PRUNING = 5 
 
+# Familias que se entrenan a la vez en el modo nocturno (todas comparten el presupuesto de API global)
+FAMILY_PARALLELISM = int(os.getenv("ACHILLES_FAMILY_PARALLELISM", "3"))
+
+# El rasterizado ya usa todos los núcleos: entre familias paralelas lo hacemos por turnos
+_RASTER_LOCK = threading.Lock()
+
 db = AgentMemory()
 
-def smart_page_selector(doc, keywords=None, max_pages=6):
-    """
-    OPTIMIZACIÓN DE RENDIMIENTO:
-    Escanea rápidamente el texto del PDF para encontrar dónde están los datos.
-    """
-    total_pages = len(doc)
-    if total_pages <= max_pages:
-        return range(total_pages)
-    
-    selected_indices = set()
-    selected_indices.add(0)
-    selected_indices.add(total_pages - 1)
+def prepare_input_images(file_path, expected_keys=None):
+    """Rasteriza un único documento a archivos temp_* (lo usa el Detective con el caso semilla)."""
+    try:
+        rendered = render_document(file_path, expected_keys=expected_keys)
+    except Exception as e:
+        print(f"❌ Error leyendo documento {file_path.name}: {e}")
+        return []
     
-    if keywords:
-        print(f"      🔎 Escaneando {total_pages} páginas buscando pistas de datos...")
-        search_terms = [str(k).lower() for k in keywords]
-        
-        for i in range(total_pages):
-            if i in selected_indices: continue
-            try:
-                text = doc[i].get_text().lower()
-                matches = sum(1 for term in search_terms if term in text)
-                if matches >= 2:
-                    selected_indices.add(i)
-                    if len(selected_indices) >= max_pages: break
-            except: continue
+    if file_path.suffix.lower() == ".pdf":
+        print(f"      📄 PDF Optimizado ({file_path.name}): Procesando pág {rendered['pages']} de {rendered['total_pages']}")
     
-    if len(selected_indices) < 3 and total_pages > 2:
-        selected_indices.add(1)
-        
-    return sorted(list(selected_indices))
-
-def prepare_input_images(file_path, expected_keys=None):
     image_paths = []
-    suffix = file_path.suffix.lower()
+    for i, data in zip(rendered["pages"], rendered["images"]):
+        output_path = f"temp_{file_path.stem}_p{i}.jpg"
+        with open(output_path, "wb") as f: f.write(data)
+        image_paths.append(output_path)
+    return image_paths
 
-    if suffix in [".jpg", ".jpeg", ".png", ".bmp"]:
-        temp_path = f"temp_{file_path.name}"
-        shutil.copy(file_path, temp_path)
-        return [temp_path]
-
-    elif suffix == ".pdf":
-        try:
-            doc = fitz.open(file_path)
-            pages_to_process = smart_page_selector(doc, keywords=expected_keys)
-            print(f"      📄 PDF Optimizado ({file_path.name}): Procesando pág {pages_to_process} de {len(doc)}")
-            
-            for i in pages_to_process:
-                page = doc[i]
-                pix = page.get_pixmap(dpi=150) 
-                output_path = f"temp_{file_path.stem}_p{i}.jpg"
-                pix.save(output_path)
-                image_paths.append(output_path)
-            doc.close()
-            return image_paths
-        except Exception as e:
-            print(f"❌ Error leyendo PDF {file_path.name}: {e}")
-            return []
-    else: return []
-
-def run_family_batch(family_name):
+def prepare_family_batch(family_name):
     """
-    EJECUTOR DE LOTES (BATCH RUNNER):
-    Filtra estrictamente los archivos que pertenecen a la familia actual.
+    PRE-PROCESO DEL LOTE:
+    Filtra estrictamente los archivos que pertenecen a la familia actual, asegura el Prompt Maestro
+    y deja las imágenes de cada caso en image_store.
+    Retorna (batch_queue, prompt_original, táctica_cargada) o None si no hay casos.
     """
-    print(f"\n{'='*60}")
-    print(f"🚀 INICIANDO ENTRENAMIENTO DE FAMILIA: {family_name.upper()}")
-    print(f"{'='*60}")
-
     all_files = list(DOCS_DIR.glob(f"expected_*.txt"))
     batch_queue = []
     
     print(f"📂 Escaneando directorio en busca de casos para '{family_name}'...")
     
     # --- FILTRO ESTRICTO DE FAMILIA ---
-    # Esto asegura que "8797" no traiga archivos de "8797esp" y viceversa
+    # Esto asegura que "8797" no traiga archivos de "8797esp" y viceversa,
+    # ni "acme" los de "acme_corp" (cada caso pertenece a su familia conocida más larga)
     strict_prefix = f"{family_name}_" 
+    registry, known = db.get_case_families(), _known_families(family_name)
 
     for truth_file in all_files:
         # ID crudo: "expected_8797esp_doc1.txt" -> "8797esp_doc1"
         case_id = truth_file.stem.replace("expected_", "")
         
         # Validación de prefijo estricto
-        if not case_id.startswith(strict_prefix):
+        if not case_id.startswith(strict_prefix) or family_of(case_id, registry, known) != family_name:
             continue 
             
         doc_candidates = list(DOCS_DIR.glob(f"{case_id}.*"))
@@ -139,12 +116,12 @@ def run_family_batch(family_name):
         print("⚡ Prompt Maestro NO detectado. Generando SEMILLA con el primer caso...")
         seed_case = batch_queue[0]
         raw_truth = seed_case["truth_path"].read_text(encoding="utf-8")
-        seed_conf = configurator_node({"raw_ground_truth": raw_truth, "case_id": seed_case["case_id"]})
+        seed_conf = configure_case(seed_case["case_id"], raw_truth)
         seed_expected = seed_conf.get('expected_data', {})
         
         if not seed_expected:
             print("❌ Error crítico: No se pudieron leer datos del caso semilla.")
-            return
+            return None
 
         seed_imgs = prepare_input_images(seed_case["doc_path"])
         original_prompt = auto_generate_prompt_from_image(seed_imgs[0], seed_expected)
@@ -159,28 +136,108 @@ def run_family_batch(family_name):
 
     # --- PREPARACIÓN DE DATOS ---
     print(f"\n⚙️ Pre-procesando imágenes y datos para {len(batch_queue)} casos...")
-    final_batch_data = []
+    configured = []
     
-    for item in batch_queue:
-        raw_truth = item["truth_path"].read_text(encoding="utf-8")
-        conf_res = configurator_node({"raw_ground_truth": raw_truth, "case_id": item["case_id"]})
-        expected_data = conf_res.get('expected_data', {})
-        rules = conf_res.get('rules', {})
-        expected_keys = list(expected_data.keys())
-        
-        imgs = prepare_input_images(item["doc_path"], expected_keys=expected_keys)
-        
-        final_batch_data.append({
-            "case_id": item["case_id"],
-            "images": imgs,
-            "raw_truth": raw_truth,
-            "expected_data": expected_data,
-            "rules": rules
-        })
+    with telemetry.span("stage", stage="configurar", family=family_name):
+        for item in batch_queue:
+            raw_truth = item["truth_path"].read_text(encoding="utf-8")
+            conf_res = configure_case(item["case_id"], raw_truth)
+            configured.append((item, raw_truth, conf_res.get('expected_data', {}), conf_res.get('rules', {})))
+    
+    # Rasterizado en paralelo: cada documento se renderiza en un núcleo y los bytes van directo al almacén
+    jobs = []
+    for item, _, expected_data, _ in configured:
+        fields = {k: (v.get("value", "") if isinstance(v, dict) else v) for k, v in expected_data.items()}
+        jobs.append((item["case_id"], item["doc_path"], fields))
+    with _RASTER_LOCK, telemetry.span("stage", stage="rasterizar", family=family_name):
+        rendered = rasterize_batch(jobs)
+    
+    final_batch_data = []
+    with telemetry.span("stage", stage="codificar", family=family_name):
+        for item, raw_truth, expected_data, rules in configured:
+            pages = rendered.get(item["case_id"], {})
+            # Codificamos cada imagen UNA sola vez para todos los intentos del grafo
+            digests = [image_store.add_bytes(data) for data in pages.get("images", [])]
+            telemetry.count("image_bytes", sum(len(data) for data in pages.get("images", [])), family=family_name)
+            
+            final_batch_data.append({
+                "case_id": item["case_id"],
+                "image_digests": digests,
+                "image_pages": pages.get("pages", []),
+                "image_encodings": pages.get("encodings", []),
+                "raw_truth": raw_truth,
+                "expected_data": expected_data,
+                "rules": rules
+            })
+    del rendered
+    return final_batch_data, original_prompt, loaded_tactic
+
+def report_telemetry(family_name):
+    """Resume la latencia por caso de la familia y exporta spans (JSON lines) y métricas (Prometheus) a reportes/."""
+    # Solo las muestras de esta familia: en modo multi-familia corren varias a la vez
+    p = telemetry.percentiles("case_latency_seconds", family=family_name)
+    if any(p.values()):
+        print(f"      ⏱️ Latencia por caso: p50 {p[0.5]:.1f}s · p90 {p[0.9]:.1f}s · p99 {p[0.99]:.1f}s")
+    telemetry.export()
+
+def release_batch(batch):
+    print("🧹 Liberando imágenes del lote...")
+    for item in batch:
+        image_store.release(item["image_digests"])
+
+def _run_graph(family_name, run_id, graph_input):
+    """
+    Ejecuta (o reanuda, si graph_input es None) el grafo con checkpoint tras cada nodo.
+    Usa app.stream para publicar un evento "node" por cada paso (la GUI los muestra como progreso).
+    """
+    print(f"\n🔥 EJECUTANDO GRAFO DE OPTIMIZACIÓN...")
+    try:
+        final_output = None
+        with telemetry.span("stage", stage="grafo", family=family_name):
+            for mode, chunk in app.stream(graph_input, run_config(run_id), stream_mode=["updates", "values"]):
+                if mode == "values":
+                    final_output = chunk
+                    continue
+                for node, update in (chunk or {}).items():
+                    update = update or {}
+                    event_bus.publish(
+                        "node", family=family_name, run_id=run_id, node=node,
+                        attempts=update.get("attempts"), avg_score=update.get("avg_score"), is_final=update.get("is_final")
+                    )
+        print(f"\n🏁 ENTRENAMIENTO FINALIZADO.")
+        if final_output:
+            print(f"      🏆 Score Promedio Final: {final_output.get('best_avg_score', 0):.1f}%")
+            export_score_matrix(family_name, final_output.get("score_matrix"))
+        db.finish_run(run_id, "done")
+    except Exception as e:
+        print(f"❌ Error fatal: {e}")
+        import traceback; traceback.print_exc()
+        final_output = None
+        # Queda reanudable: python main.py {familia} --resume
+        db.finish_run(run_id, "error")
+    return final_output
+
+def run_family_batch(family_name):
+    """
+    EJECUTOR DE LOTES (BATCH RUNNER):
+    Prepara el lote de la familia y lanza una ejecución nueva del grafo.
+    """
+    print(f"\n{'='*60}")
+    print(f"🚀 INICIANDO ENTRENAMIENTO DE FAMILIA: {family_name.upper()}")
+    print(f"{'='*60}")
+
+    prepared = prepare_family_batch(family_name)
+    if not prepared: return None
+    final_batch_data, original_prompt, loaded_tactic = prepared
+
+    # Cada ejecución es un hilo del checkpointer; se registra para poder reanudarla
+    run_id = f"{family_name}-{time.strftime('%Y%m%d_%H%M%S')}-{os.getpid()}"
+    db.start_run(run_id, family_name)
 
     # --- INICIALIZACIÓN DEL ESTADO ---
     initial_state = {
         "family": family_name,
+        "run_id": run_id,
         "batch_queue": final_batch_data,
         "original_prompt": original_prompt,
         "current_tactic": loaded_tactic,
@@ -188,31 +245,179 @@ def run_family_batch(family_name):
         "avg_score": 0.0,
         "attempts": 0,
         "is_final": False,
+        "attempt_partial": False,
         "best_avg_score": 0.0,
         "best_tactic": None,
         "mismatches": [],
+        "score_matrix": None,
+        "candidate_tactics": [],
+        "tournament_extractions": {},
+        "api_calls": 0,
+        "tokens_used": 0,
+        "cost_usd": 0.0,
+        "cached_prompt_tokens": 0,
+        "started_at": time.time(),
+        "score_history": [],
+        "stop_reason": "",
         "tried_tactics": []
     }
 
-    print(f"\n🔥 EJECUTANDO GRAFO DE OPTIMIZACIÓN...")
-    try:
-        final_output = app.invoke(initial_state)
-        print(f"\n🏁 ENTRENAMIENTO FINALIZADO.")
-        if final_output:
-            print(f"      🏆 Score Promedio Final: {final_output.get('best_avg_score', 0):.1f}%")
-    except Exception as e:
-        print(f"❌ Error fatal: {e}")
-        import traceback; traceback.print_exc()
-        final_output = None
+    final_output = _run_graph(family_name, run_id, initial_state)
+    release_batch(final_batch_data)
+    report_telemetry(family_name)
+    return final_output
+
+def resume(family_name):
+    """
+    REANUDACIÓN:
+    Continúa la última ejecución cortada de la familia desde su último checkpoint. Las imágenes no viven
+    en el checkpoint, así que se vuelve a preparar el lote (el rasterizado sale de page_cache); las
+    extracciones ya pagadas salen del checkpoint del grafo y de los checkpoints por caso.
+    """
+    print(f"\n{'='*60}")
+    print(f"⏯️ REANUDANDO ENTRENAMIENTO DE FAMILIA: {family_name.upper()}")
+    print(f"{'='*60}")
+
+    if not CHECKPOINTS_AVAILABLE:
+        print("❌ Falta el paquete langgraph-checkpoint-sqlite: no hay checkpoints que reanudar.")
+        return None
+    run_id = db.get_resumable_run(family_name)
+    snapshot = app.get_state(run_config(run_id)) if run_id else None
+    if not snapshot or not snapshot.values:
+        print(f"❌ No hay ninguna ejecución interrumpida de '{family_name}'.")
+        return None
+    if not snapshot.next:
+        print("✅ La última ejecución ya había terminado.")
+        db.finish_run(run_id, "done")
+        return snapshot.values
 
-    print("🧹 Eliminando imágenes temporales...")
-    for item in final_batch_data:
-        for img in item["images"]:
-            try:
-                if os.path.exists(img): os.remove(img)
-            except: pass
+    prepared = prepare_family_batch(family_name)
+    if not prepared: return None
+    final_batch_data = prepared[0]
+    print(f"      📍 Ejecución {run_id}: intento {snapshot.values.get('attempts', 0)}, siguiente paso: {', '.join(snapshot.next)}")
+    # El tiempo parado no cuenta para ACHILLES_MAX_MINUTES: se conserva solo el tiempo activo
+    # (de started_at al último checkpoint) y el reloj sigue desde ahora
+    started_at = snapshot.values.get("started_at") or time.time()
+    try: active = max(0.0, datetime.fromisoformat(snapshot.created_at).timestamp() - started_at)
+    except (TypeError, ValueError): active = 0.0
+    # Refrescamos las referencias a image_store del lote recién preparado
+    app.update_state(run_config(run_id), {"batch_queue": final_batch_data, "started_at": time.time() - active})
+    db.start_run(run_id, family_name)
 
+    final_output = _run_graph(family_name, run_id, None)
+    release_batch(final_batch_data)
+    report_telemetry(family_name)
     return final_output
 
+def export_score_matrix(family_name, matrix_state):
+    """Guarda la matriz caso x campo x intento en reportes/ (CSV largo + resumen JSON)."""
+    matrix = ScoreMatrix.from_state(matrix_state)
+    if not matrix or not matrix.attempts: return None
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    base = REPORTS_DIR / f"scores_{family_name}_{time.strftime('%Y%m%d_%H%M%S')}"
+    try:
+        matrix.export_csv(base.with_suffix(".csv"))
+        matrix.export_json(base.with_suffix(".json"))
+        print(f"      🧮 Matriz de scores exportada: {base.name}.csv")
+    except OSError as e:
+        print(f"      ⚠️ No se pudo exportar la matriz de scores: {e}")
+        return None
+    return base
+
+def configure_case(case_id, raw_truth):
+    """
+    Parsea el ground truth de un caso con memo persistente (agent_memory.db).
+    Solo llama al Configurador (y quizá al LLM) si este texto exacto nunca se parseó.
+    """
+    truth_hash = hashlib.sha256(raw_truth.encode("utf-8")).hexdigest()
+    cached = db.get_parsed_truth(truth_hash)
+    if cached:
+        return cached
+    
+    conf_res = configurator_node({"raw_ground_truth": raw_truth, "case_id": case_id})
+    if conf_res.get('expected_data'):
+        db.save_parsed_truth(case_id, truth_hash, conf_res['expected_data'], conf_res.get('rules', {}))
+    return conf_res
+
+def _known_families(*extra):
+    """Familias conocidas (registradas al agregar casos o con Prompt Maestro), de la más larga a la más corta."""
+    known = set(db.get_case_families().values()) | {p.stem.replace("MASTER_", "", 1) for p in PROMPTS_DIR.glob("MASTER_*.txt")}
+    return sorted(known | set(extra), key=len, reverse=True)
+
+def family_of(case_id, registry, known):
+    """
+    Familia de un caso: la registrada al agregarlo; si no, la familia conocida de prefijo más largo
+    ("acme_corp_doc1" es de "acme_corp", no de "acme"); si no, lo anterior al primer "_".
+    """
+    if case_id in registry: return registry[case_id]
+    return next((f for f in known if case_id.startswith(f"{f}_")), None) or case_id.split("_", 1)[0]
+
+def discover_families():
+    """Detecta las familias presentes en casos_docs a partir de expected_{familia}_{doc}.txt."""
+    registry, known = db.get_case_families(), _known_families()
+    families = set()
+    for truth_file in DOCS_DIR.glob("expected_*.txt"):
+        case_id = truth_file.stem.replace("expected_", "")
+        if case_id in registry or "_" in case_id: families.add(family_of(case_id, registry, known))
+    return sorted(families)
+
+def run_families(families=None, parallelism=FAMILY_PARALLELISM):
+    """
+    EJECUTOR MULTI-FAMILIA (MODO NOCTURNO):
+    Entrena varias familias a la vez. Todas las llamadas comparten throttle.api_budget,
+    así que el total nunca supera los límites de concurrencia/ritmo del proveedor.
+    Al final escribe un resumen por familia en reportes/.
+    """
+    families = families or discover_families()
+    if not families:
+        print("❌ No se encontraron familias para entrenar.")
+        return []
+    
+    print(f"\n🌙 ENTRENAMIENTO MULTI-FAMILIA: {len(families)} familias ({parallelism} en paralelo)")
+    
+    def run_one(family):
+        started = time.time()
+        try:
+            output = run_family_batch(family)
+            status = "ok" if output else "sin_resultados"
+        except Exception as e:
+            print(f"❌ Error en familia {family}: {e}")
+            output, status = None, "error"
+        return {
+            "family": family,
+            "status": status,
+            "cases": len(output.get("batch_queue", [])) if output else 0,
+            "attempts": output.get("attempts", 0) if output else 0,
+            "best_avg_score": round(output.get("best_avg_score", 0.0), 2) if output else 0.0,
+            "api_calls": output.get("api_calls", 0) if output else 0,
+            "tokens_used": output.get("tokens_used", 0) if output else 0,
+            "cached_prompt_tokens": output.get("cached_prompt_tokens", 0) if output else 0,
+            "cost_usd": round(output.get("cost_usd", 0.0), 4) if output else 0.0,
+            "stop_reason": output.get("stop_reason", "") if output else "",
+            "seconds": round(time.time() - started, 1),
+        }
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(families)))) as pool:
+        summary = list(pool.map(run_one, families))
+    
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    report_path = REPORTS_DIR / f"resumen_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    
+    print(f"\n{'='*60}\n📋 RESUMEN POR FAMILIA\n{'='*60}")
+    for row in summary:
+        print(f"   {row['family']:<20} {row['status']:<15} {row['best_avg_score']:>6.1f}%  {row['attempts']} intentos  {row['cases']} casos  {row['api_calls']} llamadas  {row['seconds']:.0f}s  {row['stop_reason']}")
+    print(f"💾 Resumen guardado en: {report_path}")
+    return summary
+
 if __name__ == "__main__":
-    run_family_batch("test")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Achilles: entrenamiento de Prompts Maestros por familia")
+    parser.add_argument("families", nargs="*", help="Familias a entrenar (por defecto: todas las de casos_docs)")
+    parser.add_argument("--parallel", type=int, default=FAMILY_PARALLELISM, help="Familias simultáneas")
+    parser.add_argument("--resume", action="store_true", help="Reanuda la última ejecución cortada de cada familia indicada")
+    args = parser.parse_args()
+    if args.resume:
+        for family in args.families: resume(family)
+    else:
+        run_families(args.families, parallelism=args.parallel)
\ No newline at end of file
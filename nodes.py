@@ -1,7 +1,16 @@
-import base64, json, re
+import json, re, math, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fireworks.client import Fireworks
-from validators import validate_result
+from validators import compile_validation_plan
 from database import AgentMemory
+from throttle import MAX_CONCURRENT_REQUESTS
+from llm_cache import cached_completion
+from image_store import image_store
+from truth_parser import parse_ground_truth_text, MIN_LOCAL_CONFIDENCE
+from score_matrix import ScoreMatrix
+from controller import UsageMeter, loop_controller
+from events import event_bus
+from telemetry import telemetry, traced_node
 import os
 from dotenv import load_dotenv
 
@@ -13,89 +22,348 @@ client = Fireworks(api_key=os.getenv("FIREWORKS_API_KEY"))
 db = AgentMemory()
 MODEL = ""
 
-def extraction_node(state):
-    print(f"\n[PASO: EXTRACCIÓN MASIVA] 🤖 Procesando lote de {len(state['batch_queue'])} documentos...")
-    batch_results = state.get("batch_results", {})
-    tactic = state.get("current_tactic", "")
+# --- CONTROL DEL CICLO ---
+# El criterio de parada (objetivo, presupuesto, convergencia) vive en controller.py
+# Corta un intento en cuanto ya no puede batir al mejor score (ahorra las llamadas restantes)
+EARLY_STOP = os.getenv("ACHILLES_EARLY_STOP", "0") == "1"
+# --- EVALUACIÓN POR CARRERA (RACING) ---
+# La táctica nueva se prueba antes en una muestra estratificada; si la cota superior de Hoeffding
+# de su promedio queda por debajo del mejor score, se descarta sin extraer el resto del lote.
+RACING = os.getenv("ACHILLES_RACING", "0") == "1"
+RACE_SAMPLE_FRACTION = 0.25
+RACE_MIN_SAMPLE = 5
+RACE_DELTA = 0.05  # Probabilidad admitida de descartar una táctica que sí era mejor
+
+# --- MODO POBLACIÓN (SUCCESSIVE HALVING) ---
+# >1: el Arquitecto propone N tácticas; se comparan en subconjuntos crecientes del lote y solo
+# la ganadora pasa a la extracción completa.
+POPULATION_SIZE = max(1, int(os.getenv("ACHILLES_POPULATION", "1")))
+HALVING_MIN_CASES = 2
+
+# Campos con peor tasa de fallo que se le muestran al Arquitecto
+WORST_FIELDS_IN_PROMPT = 8
+
+def _extract_case(case, original_prompt, tactic, meter=None, family=None):
+    """Extrae un único caso. Cualquier error queda aislado en el caso y devuelve {}. family etiqueta la telemetría."""
+    cid = case["case_id"]
+    t0 = time.perf_counter()
+    keys = list(case["expected_data"].keys())
     
-    for case in state["batch_queue"]:
-        cid = case["case_id"]
-        final_prompt = state["original_prompt"]
-        keys = list(case["expected_data"].keys())
-        
-        schema_instruction = f"""
-        OUTPUT SCHEMA: Return a JSON object with these EXACT keys:
-        {json.dumps(keys)}
-        Each value must be an object: {{"value": "extracted info", "status": "approved"}}
-        """
-        full_prompt = f"{schema_instruction}\n\nTACTIC (Specific Rules):\n{tactic}\n\nTASK (Visual Layout):\n{final_prompt}"
-        
-        content = [{"type": "text", "text": full_prompt}]
-        for img_path in case["images"]:
-            try:
-                with open(img_path, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-                content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}})
+    schema_instruction = f"""
+    OUTPUT SCHEMA: Return a JSON object with these EXACT keys:
+    {json.dumps(keys)}
+    Each value must be an object: {{"value": "extracted info", "status": "approved"}}
+    """
+    
+    # --- PREFIJO ESTABLE ---
+    # Lo que no cambia entre intentos va primero (imágenes, prompt base, esquema) para que el proveedor
+    # pueda reutilizar su caché de prefijo; la táctica, que cambia en cada intento, va al final.
+    content, owned = [], []
+    with telemetry.span("encode"):
+        # Las imágenes ya vienen codificadas desde main.py; solo referenciamos sus partes preparadas
+        digests = case.get("image_digests")
+        if digests is None:
+            # Caso sin lote preparado: las referencias son de esta llamada y se liberan al terminar
+            for img_path in case.get("images", []):
+                try: owned.append(image_store.add_file(img_path))
+                except: pass
+            digests = owned
+        for digest in digests:
+            try: content.append(image_store.part(digest))
             except: pass
+    content.append({"type": "text", "text": f"TASK (Visual Layout):\n{original_prompt}\n\n{schema_instruction}"})
+    content.append({"type": "text", "text": f"TACTIC (Specific Rules):\n{tactic}"})
 
-        try:
-            response = client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": content}], response_format={"type": "json_object"}, temperature=0)
+    try:
+        response = cached_completion(client, meter=meter, model=MODEL, messages=[{"role": "user", "content": content}], response_format={"type": "json_object"}, temperature=0)
+        with telemetry.span("json_parse"):
             clean_json = re.sub(r"```json|```", "", response.choices[0].message.content).strip()
             match = re.search(r"\{.*\}", clean_json, re.DOTALL)
-            data = json.loads(match.group(0)) if match else {}
-        except Exception as e:
-            print(f"      ❌ Error en {cid}: {e}")
-            data = {}
+            return json.loads(match.group(0)) if match else {}
+    except Exception as e:
+        print(f"      ❌ Error en {cid}: {e}")
+        telemetry.count("case_errors", family=family)
+        return {}
+    finally:
+        if owned: image_store.release(owned)
+        telemetry.observe("case_latency_seconds", time.perf_counter() - t0, family=family)
 
-        batch_results[cid] = {"extraction": data, "expected": case["expected_data"]}
+def _run_pipeline(cases, original_prompt, tactic, plan, stop_when=None, tag="", meter=None, done=None, on_case=None, family=None):
+    """
+    PIPELINE EXTRACCIÓN -> VALIDACIÓN:
+    Extrae los casos en paralelo y valida cada uno en cuanto vuelve su respuesta.
+    stop_when(hechos, suma_scores, pendientes) -> True cancela los casos que aún no salieron a la API.
+    tag identifica la táctica en el log cuando varias se evalúan a la vez.
+    done = { case_id: extracción } ya pagadas (checkpoint): se validan sin volver a llamar a la API.
+    on_case(case_id, extracción) se invoca tras cada extracción nueva para persistirla.
+    Retorna (resultados por case_id en el orden del lote, se_cortó_antes).
+    """
+    results, stopped, running_sum = {}, False, 0.0
+    done = done or {}
+    
+    def record(case, data, reused=False):
+        nonlocal running_sum
+        cid = case["case_id"]
+        with telemetry.span("validate"):
+            mismatches, score, fields = plan.check(data, case["expected_data"])
+        results[cid] = {"extraction": data, "expected": case["expected_data"], "score": score, "mismatches": mismatches, "fields": fields}
+        running_sum += score
+        icon = "♻️" if reused else ("✅" if not mismatches else "🟠")
+        print(f"      {icon} {tag}[{len(results)}/{len(cases)}] {cid}: {score:.1f}% (promedio parcial {running_sum / len(results):.1f}%)")
+        event_bus.publish("case", case_id=cid, tag=tag.strip(), score=score, done=len(results), total=len(cases), running_avg=running_sum / len(results), reused=reused)
+        return bool(stop_when and stop_when(len(results), running_sum, len(cases) - len(results)))
+    
+    for case in cases:
+        if stopped: break
+        if case["case_id"] in done: stopped = record(case, done[case["case_id"]], reused=True)
     
-    return {"batch_results": batch_results, "attempts": state["attempts"] + 1}
+    pending = [case for case in cases if case["case_id"] not in results]
+    if pending and not stopped:
+        workers = max(1, min(MAX_CONCURRENT_REQUESTS, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_extract_case, case, original_prompt, tactic, meter, family): case for case in pending}
+            for future in as_completed(futures):
+                if future.cancelled(): continue
+                case = futures[future]
+                cid = case["case_id"]
+                try: data = future.result()
+                except Exception as e:
+                    print(f"      ❌ Error en {cid}: {e}")
+                    data = {}
+                
+                # Solo persistimos respuestas útiles: un error se vuelve a intentar al reanudar
+                if on_case and data:
+                    try: on_case(cid, data)
+                    except Exception as e: print(f"      ⚠️ No se pudo guardar el checkpoint de {cid}: {e}")
+                
+                if record(case, data) and not stopped:
+                    stopped = True
+                    for f in futures: f.cancel()
+    
+    # Mantenemos el orden del lote; los casos cancelados quedan marcados como omitidos
+    ordered = {}
+    for case in cases:
+        cid = case["case_id"]
+        ordered[cid] = results.get(cid, {"extraction": {}, "expected": case["expected_data"], "skipped": True})
+    return ordered, stopped
+
+def hoeffding_upper_bound(mean, n, population, delta=RACE_DELTA):
+    """Cota superior del promedio del lote (scores en [0, 100]) tras ver n casos sin reemplazo (Serfling)."""
+    if n <= 0: return 100.0
+    finite = max(0.0, 1 - (n - 1) / population) if population else 1.0
+    return mean + 100.0 * math.sqrt(finite * math.log(1 / delta) / (2 * n))
+
+def _stratified_order(cases, previous_results):
+    """
+    Ordena el lote para que cada prefijo sea una muestra estratificada por el score del intento anterior:
+    se ordena por score y se recorre con la secuencia de van der Corput (0, 1/2, 1/4, 3/4, ...).
+    Los casos sin score previo cuentan como el estrato más bajo.
+    """
+    def previous_score(case):
+        score = (previous_results or {}).get(case["case_id"], {}).get("score")
+        return (-1.0 if score is None else score, case["case_id"])
+    ordered = sorted(cases, key=previous_score)
+    n = len(ordered)
+    picked, seen, k = [], set(), 0
+    while len(picked) < n:
+        x, f, i = 0.0, 0.5, k
+        while i:
+            x += f * (i & 1)
+            i >>= 1
+            f /= 2
+        idx = int(x * n)
+        if idx not in seen:
+            seen.add(idx)
+            picked.append(ordered[idx])
+        k += 1
+    return picked
+
+def _race_tactic(cases, original_prompt, tactic, plan, best_avg, previous_results, stop_when=None, meter=None, done=None, on_case=None, family=None):
+    """
+    CARRERA: primero la muestra, luego (si sobrevive) el resto del lote.
+    Retorna (resultados en el orden del lote, se_cortó_antes) con la misma forma que _run_pipeline.
+    """
+    total = len(cases)
+    sample = _stratified_order(cases, previous_results)[:max(RACE_MIN_SAMPLE, int(total * RACE_SAMPLE_FRACTION))]
+    sample_ids = {c["case_id"] for c in sample}
+    
+    def hopeless(n, running_sum, pending):
+        return n >= RACE_MIN_SAMPLE and hoeffding_upper_bound(running_sum / n, n, total) < best_avg
+    
+    print(f"      🏁 Carrera: {len(sample)} casos de muestra estratificada antes del lote completo (mejor a batir: {best_avg:.1f}%)...")
+    sample_results, rejected = _run_pipeline(sample, original_prompt, tactic, plan, stop_when=hopeless, meter=meter, done=done, on_case=on_case, family=family)
+    sample_scores = [r["score"] for r in sample_results.values() if not r.get("skipped")]
+    sample_sum = sum(sample_scores)
+    
+    if rejected:
+        upper = hoeffding_upper_bound(sample_sum / len(sample_scores), len(sample_scores), total)
+        print(f"      🚫 Táctica descartada en la muestra: cota superior {upper:.1f}% < {best_avg:.1f}% ({total - len(sample_scores)} casos sin llamar a la API).")
+        results = {}
+        for case in cases:
+            cid = case["case_id"]
+            results[cid] = sample_results.get(cid, {"extraction": {}, "expected": case["expected_data"], "skipped": True})
+        return results, True
+    
+    rest = [c for c in cases if c["case_id"] not in sample_ids]
+    print(f"      ✅ La táctica supera la muestra ({sample_sum / max(len(sample_scores), 1):.1f}%). Extrayendo los {len(rest)} casos restantes...")
+    
+    def stop_rest(n, running_sum, pending):
+        # Los contadores del resto se acumulan sobre los de la muestra
+        n_all, sum_all = n + len(sample_scores), running_sum + sample_sum
+        return hopeless(n_all, sum_all, pending) or bool(stop_when and stop_when(n_all, sum_all, pending))
+    
+    rest_results, stopped = _run_pipeline(rest, original_prompt, tactic, plan, stop_when=stop_rest, meter=meter, done=done, on_case=on_case, family=family)
+    if stopped:
+        skipped = sum(1 for r in rest_results.values() if r.get("skipped"))
+        print(f"      ✂️ Corte anticipado en el resto del lote: la táctica ya no puede ganar. {skipped} casos sin llamar a la API.")
+    merged = {**sample_results, **rest_results}
+    return {case["case_id"]: merged[case["case_id"]] for case in cases}, stopped
 
+@traced_node("extraer")
+def extraction_node(state):
+    cases = state["batch_queue"]
+    workers = max(1, min(MAX_CONCURRENT_REQUESTS, len(cases)))
+    print(f"\n[PASO: EXTRACCIÓN MASIVA] 🤖 Procesando lote de {len(cases)} documentos ({workers} en paralelo)...")
+    tactic = state.get("current_tactic", "")
+    plan = compile_validation_plan(state.get("rules", {}))
+    total = len(cases)
+    meter = UsageMeter()
+    
+    # Checkpoint por caso: si este intento ya había empezado (ejecución reanudada), no repetimos lo pagado
+    run_id, attempt = state.get("run_id"), state["attempts"] + 1
+    done, on_case = {}, None
+    if run_id:
+        done = db.get_case_results(run_id, attempt, tactic)
+        if done: print(f"      ♻️ Reanudando intento {attempt}: {len(done)} casos ya extraídos.")
+        on_case = lambda cid, data: db.save_case_result(run_id, attempt, tactic, cid, data)
+    # Los casos que la ganadora del torneo ya extrajo no se vuelven a pagar (no dependemos de la caché LLM)
+    tournament_done = state.get("tournament_extractions") or {}
+    if tournament_done:
+        print(f"      🏆 {len(tournament_done)} casos reutilizados del torneo.")
+        done = {**tournament_done, **done}
+    
+    best_avg = state.get("best_avg_score", 0.0)
+    
+    def cannot_beat_best(done, running_sum, pending):
+        # Aunque todo lo pendiente saliera perfecto, ¿superamos al líder? Sin líder (0%) nunca se corta:
+        # un intento parcial no puede coronarse y el ciclo se quedaría sin táctica ganadora.
+        return EARLY_STOP and (running_sum + pending * 100.0) / total < best_avg
+
+    # Solo corremos carrera cuando hay un score que batir y el lote da para una muestra útil
+    if RACING and best_avg > 0 and total >= 2 * RACE_MIN_SAMPLE:
+        batch_results, stopped = _race_tactic(
+            cases, state["original_prompt"], tactic, plan, best_avg, state.get("batch_results", {}), stop_when=cannot_beat_best, meter=meter, done=done, on_case=on_case, family=state["family"]
+        )
+    else:
+        batch_results, stopped = _run_pipeline(cases, state["original_prompt"], tactic, plan, stop_when=cannot_beat_best, meter=meter, done=done, on_case=on_case, family=state["family"])
+        if stopped:
+            skipped = sum(1 for r in batch_results.values() if r.get("skipped"))
+            print(f"      ✂️ Corte anticipado: ya no puede superar el {best_avg:.1f}% del líder. {skipped} casos sin llamar a la API.")
+    
+    # Solo si el proveedor informa usage.prompt_tokens_details.cached_tokens
+    if meter.cached_prompt_tokens:
+        share = meter.cached_prompt_tokens / max(meter.prompt_tokens, 1)
+        print(f"      🧊 Caché de prefijo del proveedor: {meter.cached_prompt_tokens}/{meter.prompt_tokens} tokens de entrada ({share:.0%}).")
+    
+    return {"batch_results": batch_results, "attempts": state["attempts"] + 1, "attempt_partial": stopped, "tournament_extractions": {}, **meter.state_update(state)}
+
+@traced_node("validar")
 def validation_node(state):
     print(f"[PASO: VALIDACIÓN CRUZADA] ⚖️ Calculando Score Promedio...")
     total_score = 0.0
     current_results = state.get("batch_results", {})
-    total_cases = len(current_results)
     global_mismatches = [] 
+    partial = state.get("attempt_partial", False)
+    
+    # Plan de validación compilado una vez por juego de reglas (se recompila solo si el Juez las cambia)
+    plan = compile_validation_plan(state.get("rules", {}))
     
+    # Matriz caso x campo x intento: un bloque nuevo por cada intento
+    matrix = ScoreMatrix.from_state(state.get("score_matrix")) or ScoreMatrix.for_batch(state["batch_queue"])
+    attempt = matrix.add_attempt()
+    
+    evaluated = 0
     for cid, res in current_results.items():
-        mismatches, score = validate_result(res["extraction"], res["expected"], state.get("rules", {}))
+        if res.get("skipped"): continue
+        # En modo pipeline el caso ya viene validado desde la extracción
+        if "fields" not in res:
+            res["mismatches"], res["score"], res["fields"] = plan.check(res["extraction"], res["expected"])
+        mismatches, score = res["mismatches"], res["score"]
+        matrix.record_case(attempt, cid, res["fields"])
         total_score += score
+        evaluated += 1
         if mismatches:
             for m in mismatches: global_mismatches.append(f"[CASE {cid}] {m}")
-        current_results[cid]["score"] = score
-        current_results[cid]["mismatches"] = mismatches
 
-    avg_score = total_score / total_cases if total_cases > 0 else 0
-    print(f"      📊 Score Promedio del Lote: {avg_score:.1f}% (Mejor anterior: {state['best_avg_score']:.1f}%)")
+    avg_score = total_score / evaluated if evaluated > 0 else 0
+    partial_note = f" [PARCIAL: {evaluated}/{len(current_results)} casos]" if partial else ""
+    print(f"      📊 Score Promedio del Lote: {avg_score:.1f}%{partial_note} (Mejor anterior: {state['best_avg_score']:.1f}%)")
 
     if global_mismatches:
         print(f"      ⚠️ DIAGNÓSTICO DE FALLOS ({len(global_mismatches)} errores):")
         for err in global_mismatches[:5]: print(f"         🔴 {err}")
     else: print("      ✅ ¡Cero errores detectados!")
 
+    worst = matrix.worst_fields(attempt, k=3)
+    if worst:
+        print("      🧮 Campos más débiles: " + ", ".join(f"{f} ({r:.0%} fallos)" for f, r in worst))
+    if attempt > 0:
+        regressions = matrix.regressions(attempt - 1, attempt)
+        if regressions:
+            print(f"      ↩️ Regresiones vs intento anterior: {len(regressions)} celdas (caso, campo) que antes acertaban.")
+
     best_avg = state["best_avg_score"]
     best_tac = state["best_tactic"]
     
-    if avg_score >= best_avg:
+    # Un intento cortado a medias no puede coronarse: su promedio no cubre todo el lote
+    if avg_score >= best_avg and not partial:
         best_avg = avg_score
         best_tac = state.get("current_tactic")
         if avg_score > 0 and best_tac:
             print("      📈 ¡Nueva Táctica Líder identificada!")
             db.save_success(state['family'], best_tac, avg_score)
 
-    is_final = False
-    if avg_score >= 98.0 or state["attempts"] >= 5:
-        is_final = True
+    # El controlador decide si seguir: objetivo, presupuesto (llamadas/tokens/tiempo/costo) o convergencia
+    score_history = state.get("score_history", []) + [loop_controller.history_entry(state, avg_score, best_avg, partial)]
+    is_final, stop_reason = loop_controller.decide({**state, "score_history": score_history})
+    gain = loop_controller.gain_per_pass(score_history, len(state["batch_queue"]))
+    gain_note = f", +{gain:.2f} pts/pasada del lote" if gain is not None else ""
+    print(f"      💰 Consumo: {state.get('api_calls', 0)} llamadas, {state.get('tokens_used', 0)} tokens{gain_note}")
+    
+    event_bus.publish(
+        "attempt", family=state["family"], attempt=state["attempts"], avg_score=avg_score, best_avg_score=best_avg,
+        partial=partial, api_calls=state.get("api_calls", 0), is_final=is_final, stop_reason=stop_reason
+    )
+    if is_final:
+        print(f"      🛑 Fin del ciclo: {stop_reason}.")
         if best_tac: save_master_prompt(state["family"], state["original_prompt"], best_tac)
     else: db.save_failure(state["family"], state.get("current_tactic"), global_mismatches[:5])
 
-    return {"avg_score": avg_score, "batch_results": current_results, "is_final": is_final, "best_avg_score": best_avg, "best_tactic": best_tac, "mismatches": global_mismatches}
+    return {"avg_score": avg_score, "batch_results": current_results, "is_final": is_final, "best_avg_score": best_avg, "best_tactic": best_tac, "mismatches": global_mismatches, "score_matrix": matrix.to_state(), "score_history": score_history, "stop_reason": stop_reason}
+
+def _censor_tactic(tactic, expected_data):
+    """Censura anti-leakage: ningún valor esperado puede quedar escrito literalmente en la táctica."""
+    for key, item in (expected_data or {}).items():
+        val_real = str(item.get("value", "")).strip()
+        if len(val_real) >= 4 and val_real in tactic:
+            tactic = tactic.replace(val_real, f"{{{{VALUE_FOR_{key}}}}}")
+    return tactic
 
+def _apply_rule_updates(rules, rule_updates, verbose=False):
+    updated_rules = (rules or {}).copy()
+    for field, new_rule in (rule_updates or {}).items():
+        clean_id = str(field).split(":")[0].strip()
+        if verbose: print(f"         - ID '{clean_id}': Se cambia a regla '{new_rule}'")
+        if isinstance(updated_rules.get(clean_id), dict): updated_rules[clean_id]['rule'] = new_rule
+        else: updated_rules[clean_id] = new_rule
+    return updated_rules
+
+@traced_node("optimizar")
 def optimizer_node(state):
     print(f"[PASO: OPTIMIZACIÓN] 🔧 El Arquitecto está auditando reglas, estrategia y MEMORIA HISTÓRICA...")
     
     current_mismatches = state.get('mismatches', [])
+    meter = UsageMeter()
     previous_tactic = state.get('current_tactic')
     original_prompt = state.get('original_prompt', "")
     
@@ -108,6 +376,13 @@ def optimizer_node(state):
         failures_context = "\n".join([f"- {f[:200]}..." for f in recent_failures])
     
     errors_summary = json.dumps(current_mismatches[:15], indent=2)
+    
+    # Tasa de fallo por campo en todo el lote (no solo los primeros errores del log)
+    worst_fields_context = "No per-field data yet."
+    matrix = ScoreMatrix.from_state(state.get("score_matrix"))
+    if matrix and matrix.attempts:
+        worst = matrix.worst_fields(k=WORST_FIELDS_IN_PROMPT)
+        if worst: worst_fields_context = "\n".join(f"- {{{{{f}:name}}}}: fails in {r:.0%} of the cases" for f, r in worst)
     current_rules = json.dumps(state.get('rules', {}), indent=2)
     
     valid_vars = []
@@ -118,6 +393,22 @@ def optimizer_node(state):
     try:
         with open("MASTER_PROMPT_GUIDE.md", "r", encoding="utf-8") as f: constitution = f.read()
     except: constitution = "RULES: Use {{ID:name}} syntax. Dates to ISO."
+    
+    if POPULATION_SIZE > 1:
+        output_format = f"""OUTPUT FORMAT (JSON):
+    Propose exactly {POPULATION_SIZE} DIFFERENT candidates (distinct strategies, not rewordings of the same one).
+    {{
+        "candidates": [
+            {{ "tactic": "For {{21428:name}}, ensure the date is converted to YYYY-MM-DD...", "rule_updates": {{ "ID": "name" }} }},
+            {{ "tactic": "...", "rule_updates": {{}} }}
+        ]
+    }}"""
+    else:
+        output_format = """OUTPUT FORMAT (JSON):
+    {
+        "tactic": "For {21428:name}, ensure the date is converted to YYYY-MM-DD...",
+        "rule_updates": { "ID": "name" } 
+    }"""
 
     opt_prompt = f"""
     You are the Lead Prompt Engineer.
@@ -141,6 +432,9 @@ def optimizer_node(state):
     5. CURRENT RULES:
     {current_rules}
     
+    6. WORST FIELDS (failure rate across the whole batch - PRIORITIZE THESE):
+    {worst_fields_context}
+    
     🔴 CRITICAL SYNTAX REQUIREMENT:
     You MUST refer to the fields using ONLY these variables: [{vars_instruction}]
 
@@ -158,45 +452,95 @@ def optimizer_node(state):
        - JUST the directive sentences (e.g., "For ID 21428, convert date to ISO format.").
     2. Field "rule_updates": Use only if validation logic needs changing.
 
-    OUTPUT FORMAT (JSON):
-    {{
-        "tactic": "For {{21428:name}}, ensure the date is converted to YYYY-MM-DD...",
-        "rule_updates": {{ "ID": "name" }} 
-    }}
+    {output_format}
     """
     
     try:
-        response = client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": opt_prompt}], response_format={"type": "json_object"}, temperature=0.1)
+        response = cached_completion(client, meter=meter, model=MODEL, messages=[{"role": "user", "content": opt_prompt}], response_format={"type": "json_object"}, temperature=0.1)
         res_json = json.loads(re.sub(r"```json|```", "", response.choices[0].message.content).strip())
-        new_tactic = res_json.get("tactic", previous_tactic)
-        rule_updates = res_json.get("rule_updates", {})
         
-        # Censura anti-leakage
-        if state.get('expected_data'):
-            for key, item in state['expected_data'].items():
-                val_real = str(item.get("value", "")).strip()
-                if len(val_real) >= 4 and val_real in new_tactic:
-                    new_tactic = new_tactic.replace(val_real, f"{{{{VALUE_FOR_{key}}}}}")
+        # Modo población: cada candidata distinta se guarda con su propio juego de reglas
+        if POPULATION_SIZE > 1:
+            candidates = []
+            for raw in res_json.get("candidates", [])[:POPULATION_SIZE]:
+                if not isinstance(raw, dict): continue
+                tactic = _censor_tactic(str(raw.get("tactic") or ""), state.get('expected_data'))
+                if not tactic or any(c["tactic"] == tactic for c in candidates): continue
+                candidates.append({"tactic": tactic, "rules": _apply_rule_updates(state.get('rules', {}), raw.get("rule_updates", {}))})
+            if len(candidates) > 1:
+                print(f"      🧬 EL ARQUITECTO PROPUSO {len(candidates)} TÁCTICAS CANDIDATAS.")
+                return {"candidate_tactics": candidates, **meter.state_update(state)}
+            # Con una sola candidata útil seguimos por el camino clásico: la primera con táctica no vacía
+            raw_candidates = [raw for raw in res_json.get("candidates") or [] if isinstance(raw, dict)]
+            res_json = next((raw for raw in raw_candidates if str(raw.get("tactic") or "").strip()), res_json)
+        
+        new_tactic = _censor_tactic(str(res_json.get("tactic") or "").strip(), state.get('expected_data'))
+        rule_updates = res_json.get("rule_updates", {})
+        if not new_tactic:
+            # Respuesta sin táctica útil: se conserva la actual (solo se aplican los cambios de reglas, si los hay)
+            new_tactic = state.get('current_tactic', "")
+            if not rule_updates:
+                print("      ⚠️ El Arquitecto no devolvió ninguna táctica válida. Se mantiene la actual.")
+                return {"current_tactic": new_tactic, **meter.state_update(state)}
 
         if rule_updates:
             print(f"      ⚖️ JUEZ (Cambios en Reglas):")
-            updated_rules = state.get('rules', {}).copy()
-            for field, new_rule in rule_updates.items():
-                clean_id = str(field).split(":")[0].strip()
-                print(f"         - ID '{clean_id}': Se cambia a regla '{new_rule}'")
-                if isinstance(updated_rules.get(clean_id), dict): updated_rules[clean_id]['rule'] = new_rule
-                else: updated_rules[clean_id] = new_rule
-            return {"current_tactic": new_tactic, "rules": updated_rules}
+            return {"current_tactic": new_tactic, "rules": _apply_rule_updates(state.get('rules', {}), rule_updates, verbose=True), **meter.state_update(state)}
         
         elif new_tactic != previous_tactic:
             print("      📝 EL ARQUITECTO REESCRIBIÓ LA TÁCTICA.")
-            return {"current_tactic": new_tactic}
+            return {"current_tactic": new_tactic, **meter.state_update(state)}
         else:
-            return {"current_tactic": new_tactic + "\n\n(Re-evaluating formatting rules)"}
+            return {"current_tactic": new_tactic + "\n\n(Re-evaluating formatting rules)", **meter.state_update(state)}
         
     except Exception as e:
         print(f"      ❌ Error optimizador: {e}")
-        return {"current_tactic": state.get('current_tactic', "")}
+        return {"current_tactic": state.get('current_tactic', ""), **meter.state_update(state)}
+
+@traced_node("torneo")
+def tournament_node(state):
+    """
+    TORNEO (SUCCESSIVE HALVING):
+    Todas las candidatas vivas se evalúan en el mismo subconjunto estratificado; sobrevive la mitad
+    con mejor promedio y el subconjunto se duplica, hasta que queda una. Los casos ya extraídos
+    por una candidata en rondas anteriores no se vuelven a pedir, y los de la ganadora pasan a la extracción completa.
+    """
+    candidates = state.get("candidate_tactics") or []
+    cases = state["batch_queue"]
+    print(f"[PASO: TORNEO] 🏟️ Successive halving entre {len(candidates)} tácticas candidatas...")
+    
+    order = _stratified_order(cases, state.get("batch_results", {}))
+    plans = [compile_validation_plan(c["rules"]) for c in candidates]
+    meter = UsageMeter()
+    results = [{} for _ in candidates]
+    alive = list(range(len(candidates)))
+    rounds = max(1, math.ceil(math.log2(len(candidates))))
+    size = max(HALVING_MIN_CASES, math.ceil(len(cases) / (2 ** rounds)))
+    
+    def evaluate(i, subset):
+        pending = [c for c in subset if c["case_id"] not in results[i]]
+        if pending:
+            done, _ = _run_pipeline(pending, state["original_prompt"], candidates[i]["tactic"], plans[i], tag=f"T{i + 1} ", meter=meter, family=state["family"])
+            results[i].update(done)
+    
+    while len(alive) > 1:
+        subset = order[:size]
+        # Las candidatas corren a la vez; el presupuesto global de API reparte los huecos
+        with ThreadPoolExecutor(max_workers=len(alive)) as pool:
+            list(pool.map(lambda i: evaluate(i, subset), alive))
+        means = {i: sum(results[i][c["case_id"]]["score"] for c in subset) / len(subset) for i in alive}
+        alive.sort(key=lambda i: -means[i])
+        print(f"      📐 Ronda con {len(subset)} casos: " + ", ".join(f"T{i + 1}={means[i]:.1f}%" for i in alive))
+        if size >= len(cases): break
+        alive = alive[:max(1, len(alive) // 2)]
+        size = min(len(cases), size * 2)
+    
+    winner = alive[0]
+    print(f"      🏆 Sobrevive la táctica T{winner + 1}; pasa a la extracción completa.")
+    return {
+        "current_tactic": candidates[winner]["tactic"], "rules": candidates[winner]["rules"], "candidate_tactics": [],
+        "tournament_extractions": {cid: res["extraction"] for cid, res in results[winner].items() if res["extraction"]}, **meter.state_update(state)
+    }
 
 def save_master_prompt(family, original, tactic):
     content = f"=== OPTIMIZED TACTIC (Family Version) ===\n{tactic}\n\n=== ORIGINAL PROMPT ===\n{original}"
@@ -240,7 +584,8 @@ def syntax_enforcer_agent(full_prompt_text, expected_keys):
     """
 
     try:
-        response = client.chat.completions.create(
+        response = cached_completion(
+            client,
             model=MODEL, 
             messages=[{"role": "user", "content": enforcer_prompt}], 
             temperature=0.0
@@ -287,8 +632,14 @@ def configurator_node(state):
         return {"expected_data": expected_data, "rules": rules}
     except: pass
 
-    # Intento 2: ARQUITECTO INTELIGENTE (Para Tablas o Texto Pegado)
-    print("      🐢 Vía Lenta: Detectado texto no estructurado. Activando Arquitecto AI...")
+    # Intento 2: PARSER LOCAL (TSV, CSV, "ID: valor", columnas alineadas) sin llamada de red
+    local = parse_ground_truth_text(raw_text)
+    if local["expected_data"] and local["confidence"] >= MIN_LOCAL_CONFIDENCE:
+        print(f"      ⚡ Vía Rápida: {len(local['expected_data'])} campos parseados localmente (formato {local['layout']}).")
+        return {"expected_data": local["expected_data"], "rules": local["rules"]}
+
+    # Intento 3: ARQUITECTO INTELIGENTE (Para Tablas o Texto Pegado)
+    print(f"      🐢 Vía Lenta: Texto no estructurado (confianza local {local['confidence']:.0%}). Activando Arquitecto AI...")
     
     architect_prompt = f"""
     You are a Data Parsing Architect.
@@ -320,7 +671,7 @@ def configurator_node(state):
     """
     
     try:
-        response = client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": architect_prompt}], response_format={"type": "json_object"}, temperature=0)
+        response = cached_completion(client, model=MODEL, messages=[{"role": "user", "content": architect_prompt}], response_format={"type": "json_object"}, temperature=0)
         config = json.loads(re.sub(r"```json|```", "", response.choices[0].message.content).strip())
         
         # Verificación extra: Si devolvió vacío, avisamos
@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+# --- CONFIGURACIÓN ---
+# Caché persistente de páginas renderizadas. Sobrevive entre ejecuciones (a diferencia de los temp_*.jpg).
+PAGE_CACHE_DIR = Path(os.getenv("ACHILLES_PAGE_CACHE_DIR", "page_cache"))
+PAGE_CACHE_MAX_BYTES = int(float(os.getenv("ACHILLES_PAGE_CACHE_MB", "1024")) * 1024 * 1024)
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 del contenido del archivo: si el PDF cambia, cambian todas sus claves."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class PageCache:
+    """
+    Clave: (hash del documento, índice de página, dpi, formato de salida).
+    Cada entrada es un archivo; el mtime hace de marca LRU para el desalojo por tamaño.
+    Junto a la imagen se guarda un ".params" (JSON) con los parámetros de codificación (ancho, alto, calidad).
+    """
+    def __init__(self, root=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def _path(self, doc_hash, page, dpi, fmt):
+        return self.root / doc_hash[:2] / f"{doc_hash}_p{page}_{dpi}.{fmt}"
+
+    def get(self, doc_hash, page, dpi, fmt="jpeg"):
+        path = self._path(doc_hash, page, dpi, fmt)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try: os.utime(path)  # Marca de uso reciente (LRU)
+        except OSError: pass
+        return data
+
+    def get_params(self, doc_hash, page, dpi, fmt="jpeg"):
+        """Parámetros de codificación guardados con la página, o None (entradas antiguas sin .params)."""
+        path = self._path(doc_hash, page, dpi, fmt)
+        try:
+            with open(path.with_name(f"{path.name}.params"), "r", encoding="utf-8") as f: return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, doc_hash, page, dpi, data, fmt="jpeg", params=None):
+        path = self._path(doc_hash, page, dpi, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Escritura atómica: varios procesos de rasterizado pueden escribir a la vez
+        if params is not None:
+            meta = path.with_name(f"{path.name}.params")
+            tmp = meta.with_name(f"{meta.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(params), encoding="utf-8")
+            os.replace(tmp, meta)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _entries(self):
+        if not self.root.exists(): return []
+        entries = []
+        for path in self.root.glob("*/*"):
+            if path.suffix in (".tmp", ".params"): continue
+            try:
+                st = path.stat()
+                entries.append((st.st_mtime, st.st_size, path))
+            except OSError: continue
+        return entries
+
+    def stats(self):
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(e[1] for e in entries), "max_bytes": self.max_bytes}
+
+    def enforce_budget(self):
+        """Desaloja las páginas menos usadas hasta quedar dentro del presupuesto de bytes."""
+        if not self.max_bytes: return 0
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes: break
+            try:
+                path.unlink()
+                total -= size
+                evicted += 1
+            except OSError: continue
+            try: path.with_name(f"{path.name}.params").unlink()
+            except OSError: pass
+        return evicted
+
+    def purge(self):
+        """Borra toda la caché de páginas."""
+        count = len(self._entries())
+        shutil.rmtree(self.root, ignore_errors=True)
+        return count
+
+page_cache = PageCache()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caché persistente de páginas renderizadas")
+    parser.add_argument("--purge", action="store_true", help="Borra todas las páginas cacheadas")
+    parser.add_argument("--stats", action="store_true", help="Muestra el tamaño actual de la caché")
+    args = parser.parse_args()
+
+    if args.purge:
+        print(f"🧹 Caché de páginas purgada: {page_cache.purge()} archivos eliminados.")
+    else:
+        info = page_cache.stats()
+        print(f"📦 Caché de páginas: {info['entries']} archivos, {info['bytes'] / 1024 / 1024:.1f} MB de {info['max_bytes'] / 1024 / 1024:.0f} MB")
@@ -0,0 +1,236 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import fitz  # PyMuPDF
+from page_cache import page_cache, file_digest
+from text_index import DocumentTextIndex
+
+# --- CONFIGURACIÓN ---
+# Este módulo NO importa el grafo ni el cliente de Fireworks. Aun así los hijos no arrancan "livianos":
+# con forkserver o spawn se vuelve a importar __main__ (gui.py / main.py y todas sus dependencias).
+# Con forkserver esa importación ocurre una sola vez en el servidor; con spawn, en cada proceso hijo.
+RENDER_DPI = 150
+IMAGE_SUFFIXES = [".jpg", ".jpeg", ".png", ".bmp"]
+RASTER_WORKERS = int(os.getenv("ACHILLES_RASTER_WORKERS", "0")) or (os.cpu_count() or 1)
+# Nunca "fork": el padre ya tiene hilos (GUI, familias en paralelo, HTTP) y el hijo heredaría sus locks tomados
+RASTER_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+MAX_PAGES = 6
+# "heuristic": primera + última + páginas con >= 2 pistas | "ranked": mínimo de páginas que cubren todos los campos (BM25)
+PAGE_SELECTION_MODE = os.getenv("ACHILLES_PAGE_SELECTION", "heuristic")
+# Recorte: renderiza solo la región (con margen) donde aparecen los IDs/valores, a mayor dpi
+CROP_MODE = os.getenv("ACHILLES_CROP", "0") == "1"
+CROP_PADDING = float(os.getenv("ACHILLES_CROP_PADDING", "36"))   # puntos PDF (72 = 1 pulgada)
+CROP_DPI = int(os.getenv("ACHILLES_CROP_DPI", "200"))
+CROP_MAX_AREA = 0.8  # Si el recorte ocupa más que esto de la página, no compensa: página completa
+# Presupuesto por imagen: tope de píxeles y de bytes. Se reduce escala y calidad JPEG hasta cumplirlo.
+MAX_IMAGE_PIXELS = int(float(os.getenv("ACHILLES_MAX_IMAGE_MPX", "4")) * 1_000_000)
+MAX_IMAGE_BYTES = int(float(os.getenv("ACHILLES_MAX_IMAGE_KB", "1500")) * 1024)
+JPEG_QUALITY = int(os.getenv("ACHILLES_JPEG_QUALITY", "85"))
+MIN_JPEG_QUALITY = 45
+BUDGET_TAG = f"q{JPEG_QUALITY}-{MAX_IMAGE_PIXELS}-{MAX_IMAGE_BYTES}"
+
+def smart_page_selector(doc, keywords=None, max_pages=MAX_PAGES, index=None):
+    """
+    OPTIMIZACIÓN DE RENDIMIENTO:
+    Busca dónde están los datos usando el índice invertido del texto del PDF.
+    Si no se pasa un índice cacheado (DocumentTextIndex), se construye al vuelo.
+    """
+    total_pages = len(doc)
+    if total_pages <= max_pages:
+        return range(total_pages)
+
+    selected_indices = set()
+    selected_indices.add(0)
+    selected_indices.add(total_pages - 1)
+
+    if keywords:
+        print(f"      🔎 Escaneando {total_pages} páginas buscando pistas de datos...")
+        if index is None: index = DocumentTextIndex.from_doc(doc)
+        hits = index.keyword_hits(keywords)
+
+        for i in sorted(hits):
+            if i in selected_indices: continue
+            if hits[i] >= 2:
+                selected_indices.add(i)
+                if len(selected_indices) >= max_pages: break
+
+    if len(selected_indices) < 3 and total_pages > 2:
+        selected_indices.add(1)
+
+    return sorted(list(selected_indices))
+
+def ranked_page_selector(doc, fields, max_pages=MAX_PAGES, index=None):
+    """
+    Envía solo las páginas necesarias para cubrir todos los campos (IDs y valores esperados).
+    Si el PDF no tiene capa de texto útil, vuelve al selector heurístico.
+    """
+    if index is None: index = DocumentTextIndex.from_doc(doc)
+    ranked = index.rank_pages(fields, max_pages=max_pages)
+    if ranked:
+        print(f"      🎯 Ranking BM25: {len(ranked)} páginas cubren los campos de {len(doc)}")
+        return ranked
+    return smart_page_selector(doc, keywords=list(fields.keys()), max_pages=max_pages, index=index)
+
+def _budget_dpi(rect, dpi, max_pixels=MAX_IMAGE_PIXELS):
+    """Baja el dpi de render para que la página (o el recorte) no supere el tope de píxeles."""
+    pixels = (rect.width * dpi / 72) * (rect.height * dpi / 72)
+    if not max_pixels or pixels <= max_pixels: return dpi
+    return max(36, int(dpi * math.sqrt(max_pixels / pixels)))
+
+def encode_within_budget(pix, max_pixels=MAX_IMAGE_PIXELS, max_bytes=MAX_IMAGE_BYTES, quality=JPEG_QUALITY):
+    """
+    Codifica el pixmap a JPEG dentro del presupuesto: primero limita píxeles, luego baja la calidad
+    de 10 en 10 hasta MIN_JPEG_QUALITY y, si aún no entra, reduce la escala un 25% y repite.
+    Retorna (bytes, parámetros elegidos).
+    """
+    if pix.alpha: pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3): pix = fitz.Pixmap(fitz.csRGB, pix)
+    if max_pixels and pix.width * pix.height > max_pixels:
+        scale = math.sqrt(max_pixels / (pix.width * pix.height))
+        pix = fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)))
+
+    while True:
+        q = quality
+        data = pix.tobytes("jpeg", jpg_quality=q)
+        while max_bytes and len(data) > max_bytes and q - 10 >= MIN_JPEG_QUALITY:
+            q -= 10
+            data = pix.tobytes("jpeg", jpg_quality=q)
+        if not max_bytes or len(data) <= max_bytes or min(pix.width, pix.height) < 256:
+            return data, {"width": pix.width, "height": pix.height, "quality": q, "bytes": len(data)}
+        pix = fitz.Pixmap(pix, int(pix.width * 0.75), int(pix.height * 0.75))
+
+def _encode_image_file(file_path):
+    """Las fotos/escaneos sueltos se respetan tal cual si ya cumplen el presupuesto; si no, se recodifican."""
+    raw = file_path.read_bytes()
+    pix = fitz.Pixmap(raw)
+    is_jpeg = raw[:3] == b"\xff\xd8\xff"
+    if is_jpeg and pix.width * pix.height <= MAX_IMAGE_PIXELS and len(raw) <= MAX_IMAGE_BYTES:
+        return raw, {"width": pix.width, "height": pix.height, "quality": None, "bytes": len(raw)}
+    return encode_within_budget(pix)
+
+def _crop_terms(expected_keys=None, expected_values=None):
+    terms = [str(k) for k in (expected_keys or [])]
+    terms += [str(v).strip() for v in (expected_values or {}).values() if len(str(v or "").strip()) >= 3]
+    return [t for t in dict.fromkeys(terms) if len(t) >= 2]
+
+def crop_region(page, terms, padding=CROP_PADDING, max_area=CROP_MAX_AREA):
+    """
+    Une (con margen) los rectángulos donde la capa de texto contiene los términos buscados.
+    Retorna un fitz.Rect o None si no hubo coincidencias o el recorte no ahorra nada.
+    """
+    region = None
+    for term in terms:
+        try: rects = page.search_for(term)
+        except Exception: continue
+        for rect in rects:
+            region = fitz.Rect(rect) if region is None else region | rect
+    if region is None: return None
+
+    page_rect = page.rect
+    region = fitz.Rect(region.x0 - padding, region.y0 - padding, region.x1 + padding, region.y1 + padding) & page_rect
+    if region.is_empty or region.get_area() >= max_area * page_rect.get_area():
+        return None
+    return region
+
+def render_document(file_path, expected_keys=None, dpi=RENDER_DPI, expected_values=None):
+    """
+    TRABAJADOR DE RASTERIZADO (se ejecuta en un proceso hijo):
+    Abre su propio documento fitz y devuelve los bytes JPEG de las páginas elegidas.
+    expected_values ({ id: valor }) habilita el modo de selección "ranked" y mejora el recorte (CROP_MODE).
+    Cada imagen se ajusta al presupuesto de píxeles/bytes (ver encode_within_budget).
+    Retorna: { "pages": [índices], "total_pages": int, "images": [bytes], "crops": [rect | None], "encodings": [params] }
+    """
+    file_path = Path(file_path)
+    suffix = file_path.suffix.lower()
+
+    if suffix in IMAGE_SUFFIXES:
+        data, params = _encode_image_file(file_path)
+        return {"pages": [0], "total_pages": 1, "images": [data], "encodings": [params]}
+
+    if suffix != ".pdf":
+        return {"pages": [], "total_pages": 0, "images": []}
+
+    doc_hash = file_digest(file_path)
+    doc = fitz.open(file_path)
+    try:
+        ranked = PAGE_SELECTION_MODE == "ranked" and bool(expected_values)
+        # El índice (get_text de todo el PDF + escritura en disco) solo se construye si la selección lo consulta:
+        # el selector heurístico devuelve todas las páginas sin mirarlo cuando el documento es corto.
+        needs_index = ranked or (expected_keys and len(doc) > MAX_PAGES)
+        index = DocumentTextIndex.load_or_build(doc, doc_hash) if needs_index else None
+        if ranked:
+            pages_to_process = list(ranked_page_selector(doc, expected_values, index=index))
+        else:
+            pages_to_process = list(smart_page_selector(doc, keywords=expected_keys, index=index))
+        crop_terms = _crop_terms(expected_keys, expected_values) if CROP_MODE else []
+        images, crops, encodings, cache_hits = [], [], [], 0
+        for i in pages_to_process:
+            page = doc[i]
+            clip = crop_region(page, crop_terms) if crop_terms else None
+            page_dpi, fmt = dpi, f"{BUDGET_TAG}.jpeg"
+            if clip is not None:
+                page_dpi = max(dpi, CROP_DPI)
+                fmt = f"crop{int(clip.x0)}-{int(clip.y0)}-{int(clip.x1)}-{int(clip.y1)}-{fmt}"
+            page_dpi = _budget_dpi(clip if clip is not None else page.rect, page_dpi)
+            # Si la página ya se renderizó en otra ejecución, la reutilizamos tal cual
+            data = page_cache.get(doc_hash, i, page_dpi, fmt)
+            if data is None:
+                data, params = encode_within_budget(page.get_pixmap(dpi=page_dpi, clip=clip))
+                page_cache.put(doc_hash, i, page_dpi, data, fmt, params=params)
+            else:
+                # Mismos parámetros que al renderizarla (ancho, alto, calidad) para la telemetría y el presupuesto
+                params = {**(page_cache.get_params(doc_hash, i, page_dpi, fmt) or {}), "bytes": len(data), "from_cache": True}
+                cache_hits += 1
+            params["dpi"] = page_dpi
+            images.append(data)
+            encodings.append(params)
+            crops.append(tuple(round(v, 1) for v in clip) if clip is not None else None)
+        return {"pages": pages_to_process, "total_pages": len(doc), "images": images, "crops": crops, "encodings": encodings, "cache_hits": cache_hits}
+    finally:
+        doc.close()
+
+def rasterize_batch(jobs, dpi=RENDER_DPI, workers=RASTER_WORKERS):
+    """
+    ETAPA DE RASTERIZADO EN PARALELO:
+    jobs: lista de (case_id, doc_path, { id: valor_esperado }). Cada documento se procesa en un núcleo distinto.
+    Retorna: { case_id: resultado de render_document } (images = [] si el caso falló).
+    """
+    results = {}
+    if not jobs: return results
+    workers = max(1, min(workers, len(jobs)))
+
+    def report(done, case_id, res):
+        if res.get("error"):
+            print(f"      ❌ [{done}/{len(jobs)}] Error rasterizando {case_id}: {res['error']}")
+        else:
+            cached = f" ({res['cache_hits']} desde caché)" if res.get("cache_hits") else ""
+            kb = sum(len(img) for img in res["images"]) / 1024
+            print(f"      🖨️ [{done}/{len(jobs)}] {case_id}: pág {res['pages']} de {res['total_pages']} ({kb:.0f} KB){cached}")
+
+    pending = list(jobs)
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(RASTER_START_METHOD)) as pool:
+                futures = {pool.submit(render_document, path, list(fields), dpi, fields): cid for cid, path, fields in jobs}
+                for future in as_completed(futures):
+                    cid = futures[future]
+                    try: results[cid] = future.result()
+                    except BrokenProcessPool: continue
+                    except Exception as e: results[cid] = {"pages": [], "total_pages": 0, "images": [], "error": str(e)}
+                    report(len(results), cid, results[cid])
+        except Exception as e:
+            # Si el pool no arranca (ej: entorno congelado sin freeze_support), seguimos en serie
+            print(f"      ⚠️ Pool de rasterizado no disponible ({e}). Continuando en serie...")
+        pending = [job for job in jobs if job[0] not in results]
+
+    for cid, path, fields in pending:
+        try: results[cid] = render_document(path, list(fields), dpi, fields)
+        except Exception as e: results[cid] = {"pages": [], "total_pages": 0, "images": [], "error": str(e)}
+        report(len(results), cid, results[cid])
+
+    evicted = page_cache.enforce_budget()
+    if evicted: print(f"      🧹 Caché de páginas: {evicted} páginas antiguas desalojadas.")
+    return results
@@ -0,0 +1,127 @@
+import csv
+import json
+from array import array
+
+# Valores de cada celda
+MISSING, FAIL, PASS = -1, 0, 1
+
+class ScoreMatrix:
+    """
+    MATRIZ DE ACIERTOS (caso x campo x intento):
+    Un array('b') plano con un bloque de casos*campos por intento. Las tasas por campo salen de
+    slices con paso (operaciones en C), sin parsear los strings de mismatches.
+    """
+    def __init__(self, cases, fields, attempts=0, cells=None):
+        self.cases = list(cases)
+        self.fields = list(fields)
+        self._case_idx = {c: i for i, c in enumerate(self.cases)}
+        self._field_idx = {f: j for j, f in enumerate(self.fields)}
+        self.block = len(self.cases) * len(self.fields)
+        self.attempts = attempts
+        self.cells = array("b")
+        if cells: self.cells.frombytes(cells)
+        else: self.cells.extend([MISSING] * (self.block * attempts))
+
+    @classmethod
+    def for_batch(cls, batch_queue):
+        """Crea la matriz a partir del lote: une los campos esperados de todos los casos."""
+        fields = {}
+        for case in batch_queue:
+            for field in case.get("expected_data", {}): fields.setdefault(field, None)
+        return cls([case["case_id"] for case in batch_queue], list(fields))
+
+    # --- PERSISTENCIA EN EL ESTADO DEL GRAFO ---
+    def to_state(self):
+        return {"cases": self.cases, "fields": self.fields, "attempts": self.attempts, "cells": self.cells.tobytes()}
+
+    @classmethod
+    def from_state(cls, data):
+        if not data: return None
+        return cls(data["cases"], data["fields"], data["attempts"], data["cells"])
+
+    # --- ESCRITURA ---
+    def add_attempt(self):
+        """Abre un bloque vacío para un nuevo intento y devuelve su índice."""
+        self.cells.extend([MISSING] * self.block)
+        self.attempts += 1
+        return self.attempts - 1
+
+    def _add_case(self, case_id):
+        """Caso que no estaba en el lote original (p. ej. al reanudar): cada bloque crece con celdas vacías."""
+        n_fields = len(self.fields)
+        cells = array("b")
+        for a in range(self.attempts):
+            cells.extend(self.cells[a * self.block:(a + 1) * self.block])
+            cells.extend([MISSING] * n_fields)
+        self.cells = cells
+        self.block += n_fields
+        self._case_idx[case_id] = len(self.cases)
+        self.cases.append(case_id)
+        return self._case_idx[case_id]
+
+    def record(self, attempt, case_id, field, passed):
+        j = self._field_idx.get(field)
+        if j is None: return
+        i = self._case_idx.get(case_id)
+        if i is None: i = self._add_case(case_id)
+        self.cells[attempt * self.block + i * len(self.fields) + j] = PASS if passed else FAIL
+
+    def record_case(self, attempt, case_id, field_results):
+        for field, passed in field_results.items():
+            self.record(attempt, case_id, field, passed)
+
+    # --- ANÁLISIS ---
+    def _attempt_block(self, attempt):
+        if attempt < 0: attempt += self.attempts
+        start = attempt * self.block
+        return self.cells[start:start + self.block]
+
+    def field_failure_rates(self, attempt=-1):
+        """{ campo: fracción de fallos } entre los casos evaluados en ese intento."""
+        block = self._attempt_block(attempt)
+        n_fields = len(self.fields)
+        rates = {}
+        for j, field in enumerate(self.fields):
+            column = block[j::n_fields]
+            fails, passes = column.count(FAIL), column.count(PASS)
+            if fails + passes: rates[field] = fails / (fails + passes)
+        return rates
+
+    def worst_fields(self, attempt=-1, k=5):
+        rates = self.field_failure_rates(attempt)
+        return [(f, r) for f, r in sorted(rates.items(), key=lambda kv: -kv[1]) if r > 0][:k]
+
+    def regressions(self, previous, current):
+        """Celdas (caso, campo) que acertaban en 'previous' y fallan en 'current'."""
+        before, after = self._attempt_block(previous), self._attempt_block(current)
+        n_fields = len(self.fields)
+        return [
+            (self.cases[i // n_fields], self.fields[i % n_fields])
+            for i, (b, a) in enumerate(zip(before, after)) if b == PASS and a == FAIL
+        ]
+
+    # --- EXPORTACIÓN ---
+    def rows(self):
+        n_fields = len(self.fields)
+        for i, value in enumerate(self.cells):
+            if value == MISSING: continue
+            attempt, rest = divmod(i, self.block)
+            case_i, field_j = divmod(rest, n_fields)
+            yield attempt + 1, self.cases[case_i], self.fields[field_j], value
+
+    def export_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["attempt", "case_id", "field", "passed"])
+            writer.writerows(self.rows())
+
+    def export_json(self, path):
+        summary = {
+            "cases": self.cases,
+            "fields": self.fields,
+            "attempts": self.attempts,
+            "field_failure_rates": [self.field_failure_rates(a) for a in range(self.attempts)],
+            "cells": [list(self._attempt_block(a)) for a in range(self.attempts)],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
@@ -3,10 +3,12 @@ from typing import TypedDict, List, Dict, Optional, Any
 class AgentState(TypedDict):
     # --- Identificación ---
     family: str
+    run_id: str                  # thread_id del checkpointer (main.resume la reanuda)
     
     # --- Modo Batch (Lotes) ---
     # En lugar de un solo caso, tenemos una lista de casos activos
-    # Cada ítem del batch es un dict: { "case_id": str, "images": [], "ground_truth": {}, "raw_truth": str }
+    # Cada ítem del batch es un dict: { "case_id": str, "image_digests": [], "image_pages": [], "ground_truth": {}, "raw_truth": str }
+    # "image_digests" apunta a las imágenes ya codificadas en image_store (se codifican una vez por ejecución)
     batch_queue: List[Dict[str, Any]] 
     
     # --- Prompt Maestro ---
@@ -15,17 +17,40 @@ class AgentState(TypedDict):
     
     # --- Estado de Ejecución (Resultados Agregados) ---
     # Resultados por caso: { "case_id": { "extraction": {}, "score": 0.0, "mismatches": [] } }
+    # (los casos cancelados por corte anticipado llevan "skipped": True y no tienen score)
     batch_results: Dict[str, Dict] 
     
     # Métricas Globales (Promedio de la familia)
     avg_score: float
     
+    # Errores del último intento (los lee el Arquitecto)
+    mismatches: List[str]
+    
+    # Matriz acierto/fallo caso x campo x intento (ver score_matrix.py, serializada con to_state)
+    score_matrix: Optional[Dict[str, Any]]
+    
+    # Modo población: tácticas candidatas pendientes de torneo [{ "tactic": str, "rules": {} }]
+    candidate_tactics: List[Dict[str, Any]]
+    # Extracciones de la ganadora del torneo { case_id: extracción }: la extracción completa no las repite
+    tournament_extractions: Dict[str, Any]
+    
     # Datos compartidos (Reglas aprendidas)
     rules: Optional[Dict]
     
     # Control de Flujo
     attempts: int
     is_final: bool
+    attempt_partial: bool        # True si el intento se cortó antes de extraer todo el lote
+    stop_reason: str             # Motivo de parada que dio el controlador (controller.py)
+    
+    # Presupuesto consumido (solo llamadas reales; los aciertos de caché no cuentan)
+    api_calls: int
+    tokens_used: int
+    cost_usd: float
+    cached_prompt_tokens: int    # Tokens de entrada que el proveedor sirvió desde su caché de prefijo
+    started_at: float            # time.time() al arrancar el grafo (al reanudar se descuenta el tiempo parado)
+    # Un registro por intento validado: { attempt, score, best, partial, api_calls, tokens }
+    score_history: List[Dict[str, Any]]
     
     # Histórico de sesión (para Hill Climbing)
     best_avg_score: float
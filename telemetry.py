@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- CONFIGURACIÓN ---
+# JSON lines con cada span (se anexa) y archivo de texto Prometheus para el textfile collector del node exporter
+TELEMETRY_JSONL = Path(os.getenv("ACHILLES_TELEMETRY_JSONL", "reportes/telemetria.jsonl"))
+PROMETHEUS_TEXTFILE = Path(os.getenv("ACHILLES_PROM_TEXTFILE", "reportes/achilles.prom"))
+METRIC_PREFIX = "achilles"
+# Muestras retenidas por serie para calcular percentiles (las más recientes)
+MAX_SAMPLES = 10000
+# Spans retenidos entre exportaciones (los más antiguos se descartan)
+MAX_PENDING_SPANS = 100000
+QUANTILES = (0.5, 0.9, 0.99)
+
+def _series_key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+def _percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+class Telemetry:
+    """
+    TELEMETRÍA EN PROCESO:
+    - span(nombre, **labels): mide la duración de un bloque y la guarda como muestra "<nombre>_seconds".
+    - count(nombre, valor, **labels): contadores acumulados (bytes, tokens, reintentos...).
+    - observe(nombre, valor, **labels): muestras para percentiles (latencia por caso).
+    Seguro entre hilos; exporta a JSON lines y a formato de texto Prometheus.
+    """
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._spans = []
+        self._counters = {}
+        self._samples = {}
+        self._sums = {}
+
+    @contextmanager
+    def span(self, name, **labels):
+        start, t0 = time.time(), time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - t0
+            self.observe(f"{name}_seconds", seconds, **labels)
+            record = {"span": name, "start": start, "seconds": round(seconds, 6), **{k: v for k, v in labels.items() if v is not None}}
+            if error: record["error"] = error
+            with self._lock:
+                self._spans.append(record)
+                if len(self._spans) > MAX_PENDING_SPANS: del self._spans[:len(self._spans) - MAX_PENDING_SPANS]
+
+    def count(self, name, value=1, **labels):
+        if not value: return
+        key = _series_key(name, labels)
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            samples = self._samples.setdefault(key, [])
+            samples.append(value)
+            if len(samples) > self.max_samples: del samples[:len(samples) - self.max_samples]
+            total, n = self._sums.get(key, (0.0, 0))
+            self._sums[key] = (total + value, n + 1)
+
+    def percentiles(self, name, quantiles=QUANTILES, **labels):
+        """{ q: valor } sobre las muestras retenidas de la serie (todas las etiquetas si no se indican)."""
+        with self._lock:
+            if labels: values = list(self._samples.get(_series_key(name, labels), []))
+            else: values = [v for (n, _), s in self._samples.items() if n == name for v in s]
+        values.sort()
+        return {q: _percentile(values, q) for q in quantiles}
+
+    # --- EXPORTADORES ---
+    def export_jsonl(self, path=TELEMETRY_JSONL):
+        """Anexa los spans pendientes (uno por línea) y una línea con los contadores actuales."""
+        with self._lock:
+            spans, self._spans = self._spans, []
+            counters = [{"counter": n, **dict(l), "value": v} for (n, l), v in self._counters.items()]
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for record in spans: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(json.dumps({"snapshot": time.time(), "counters": counters}, ensure_ascii=False) + "\n")
+        return len(spans)
+
+    def prometheus_text(self):
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items: return ""
+            escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {k: sorted(v) for k, v in self._samples.items()}
+            sums = dict(self._sums)
+
+        lines, typed = [], set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{fmt_labels(labels)} {value}")
+        for (name, labels), values in sorted(samples.items()):
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} summary")
+                typed.add(metric)
+            for q in QUANTILES:
+                lines.append(f"{metric}{fmt_labels(labels, [('quantile', str(q))])} {_percentile(values, q):.6f}")
+            total, n = sums[(name, labels)]
+            lines.append(f"{metric}_sum{fmt_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{fmt_labels(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path=PROMETHEUS_TEXTFILE):
+        """Escritura atómica (tmp + replace): el node exporter nunca lee un archivo a medias."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f: f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def export(self):
+        try:
+            self.export_jsonl()
+            self.export_prometheus()
+        except OSError as e:
+            print(f"      ⚠️ No se pudo exportar la telemetría: {e}")
+
+# Instancia global compartida por nodos, runner, caché y presupuesto de API
+telemetry = Telemetry()
+
+def traced_node(node_name):
+    """Decorador para nodos del grafo: span "node" con el nombre del nodo y la familia del estado."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            with telemetry.span("node", node=node_name, family=state.get("family")):
+                return fn(state, *args, **kwargs)
+        return wrapper
+    return decorator
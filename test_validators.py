@@ -0,0 +1,42 @@
+import random
+import string
+from validators import normalize_string
+
+def baseline_normalize_string(text):
+    """Implementación original (antes de precompilar y memoizar): referencia para comparar byte a byte."""
+    if not text: return ""
+    text = str(text).upper()
+    text = text.replace("’", "'").replace("`", "'").replace("“", '"').replace("”", '"')
+    replacements = {"AGOSTO": "08", "JULIO": "07", "SETTEMBRE": "09", "SEPTIEMBRE": "09"}
+    for mes, num in replacements.items():
+        text = text.replace(mes, num)
+    text = text.translate(str.maketrans('', '', string.punctuation))
+    return " ".join(text.split())
+
+# Piezas con las que se arman los textos aleatorios: meses (en cualquier caja y pegados), comillas,
+# puntuación, espacios raros y letras no ASCII cuyas mayúsculas cambian de longitud ('ß' -> 'SS')
+_PIECES = [
+    "agosto", "AGOSTO", "Julio", "julio", "settembre", "SEPTIEMBRE", "septiembre", "agost", "jul",
+    "’", "‘", "“", "”", "'", '"', "`", "´",
+    ".", ",", "-", ";", ":", "/", "(", ")", "!", "?", "#", "%", "&", "_", "\\",
+    " ", "  ", "\t", "\n", " ", " ",
+    "ß", "ﬁ", "ŉ", "ç", "Ç", "ñ", "é", "Ö", "ı", "İ", "ǅ", "σ", "ς", "€", "№", "½",
+    "0", "7", "2025", "08",
+]
+
+def _random_text(rng):
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        if rng.random() < 0.7: parts.append(rng.choice(_PIECES))
+        else: parts.append("".join(rng.choice(string.printable) for _ in range(rng.randint(1, 6))))
+    return "".join(parts)
+
+def test_normalize_string_matches_baseline_on_random_strings():
+    rng = random.Random(13)
+    for _ in range(20000):
+        text = _random_text(rng)
+        assert normalize_string(text) == baseline_normalize_string(text), repr(text)
+
+def test_normalize_string_matches_baseline_on_non_strings():
+    for value in [None, "", 0, 1, 0.5, -3, 12.0, True, False, ["a", "b"], {"k": "v"}]:
+        assert normalize_string(value) == baseline_normalize_string(value), repr(value)
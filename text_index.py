@@ -0,0 +1,133 @@
+import json
+import math
+import os
+import re
+from page_cache import PAGE_CACHE_DIR
+
+# --- CONFIGURACIÓN ---
+# Los índices viven dentro de la caché de páginas: comparten presupuesto LRU y la purga.
+TEXT_INDEX_DIR = PAGE_CACHE_DIR / "text_index"
+
+_TOKEN = re.compile(r"\w+")
+
+class DocumentTextIndex:
+    """
+    ÍNDICE INVERTIDO DEL TEXTO DEL PDF:
+    Se construye una sola vez por documento (clave = hash del contenido) y se guarda en disco.
+    postings: { token: { página: frecuencia } }
+    """
+    def __init__(self, pages, postings=None):
+        self.pages = pages
+        self.postings = postings if postings is not None else self._build_postings(pages)
+        self._lengths = None
+
+    @staticmethod
+    def _build_postings(pages):
+        postings = {}
+        for i, text in enumerate(pages):
+            for token in _TOKEN.findall(text):
+                page_tf = postings.setdefault(token, {})
+                page_tf[i] = page_tf.get(i, 0) + 1
+        return postings
+
+    def __len__(self):
+        return len(self.pages)
+
+    @classmethod
+    def from_doc(cls, doc):
+        pages = []
+        for page in doc:
+            try: pages.append(page.get_text().lower())
+            except: pages.append("")
+        return cls(pages)
+
+    @classmethod
+    def load_or_build(cls, doc, doc_hash):
+        """Carga el índice cacheado del documento o lo construye y lo persiste."""
+        path = TEXT_INDEX_DIR / f"{doc_hash}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f: raw = json.load(f)
+            try: os.utime(path)  # Marca LRU compartida con la caché de páginas
+            except OSError: pass
+            postings = {tok: {int(p): tf for p, tf in pages.items()} for tok, pages in raw["postings"].items()}
+            return cls(raw["pages"], postings)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = cls.from_doc(doc)
+        try:
+            TEXT_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"pages": index.pages, "postings": index.postings}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"      ⚠️ No se pudo guardar el índice de texto: {e}")
+        return index
+
+    def pages_with(self, term):
+        """Páginas donde aparece el término (token exacto o frase verificada sobre el texto)."""
+        term = str(term).lower().strip()
+        tokens = _TOKEN.findall(term)
+        if not tokens: return set()
+        if len(tokens) == 1 and tokens[0] == term:
+            return set(self.postings.get(term, ()))
+        # Frases o términos con símbolos: intersección de postings y verificación literal
+        candidates = set(self.postings.get(tokens[0], ()))
+        for token in tokens[1:]:
+            candidates &= set(self.postings.get(token, ()))
+        return {i for i in candidates if term in self.pages[i]}
+
+    def keyword_hits(self, keywords):
+        """Cuenta, en una sola pasada por el índice, cuántas palabras clave distintas aparecen en cada página."""
+        hits = {}
+        for term in set(str(k).lower() for k in keywords):
+            for i in self.pages_with(term):
+                hits[i] = hits.get(i, 0) + 1
+        return hits
+
+    def bm25(self, terms, k1=1.5, b=0.75):
+        """Puntaje BM25 de cada página para la lista de términos (tokens) de la consulta."""
+        if self._lengths is None:
+            self._lengths = [0] * len(self.pages)
+            for page_tf in self.postings.values():
+                for i, tf in page_tf.items(): self._lengths[i] += tf
+        n = len(self.pages)
+        avg_len = (sum(self._lengths) / n) if n else 0
+        scores = {}
+        for token in set(t for term in terms for t in _TOKEN.findall(str(term).lower())):
+            page_tf = self.postings.get(token)
+            if not page_tf: continue
+            idf = math.log((n - len(page_tf) + 0.5) / (len(page_tf) + 0.5) + 1)
+            for i, tf in page_tf.items():
+                norm = k1 * (1 - b + b * (self._lengths[i] / avg_len if avg_len else 1))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def rank_pages(self, fields, max_pages=6, min_value_len=3):
+        """
+        SELECCIÓN POR RELEVANCIA:
+        fields = { id_campo: valor_esperado }. Un campo queda "cubierto" por una página si aparece
+        su ID o su valor esperado. Elegimos de forma voraz las páginas que cubren más campos pendientes
+        (desempate por BM25) hasta cubrirlos todos o llegar a max_pages.
+        Retorna la lista ordenada de páginas o [] si el texto no aporta ninguna pista.
+        """
+        coverage = {}
+        for key, value in fields.items():
+            pages = set(self.pages_with(key))
+            value = str(value or "").strip()
+            if len(value) >= min_value_len: pages |= self.pages_with(value)
+            for i in pages: coverage.setdefault(i, set()).add(key)
+        if not coverage: return []
+
+        scores = self.bm25(list(fields.keys()) + [str(v) for v in fields.values() if v])
+        pending = set().union(*coverage.values())
+        selected = []
+        while pending and len(selected) < max_pages:
+            best = max(coverage, key=lambda i: (len(coverage[i] & pending), scores.get(i, 0.0), -i))
+            gained = coverage[best] & pending
+            if not gained: break
+            selected.append(best)
+            pending -= gained
+            del coverage[best]
+        return sorted(selected)
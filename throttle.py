@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from telemetry import telemetry
+
+load_dotenv()
+
+# --- CONFIGURACIÓN ---
+# Máximo de llamadas simultáneas a Fireworks y tope de peticiones por minuto.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("ACHILLES_MAX_CONCURRENCY", "4"))
+REQUESTS_PER_MINUTE = int(os.getenv("ACHILLES_RPM", "60"))
+# Reintentos cuando el proveedor responde 429 (límite excedido) pese al presupuesto local
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF_SECONDS = 5.0
+
+def is_rate_limit_error(e):
+    text = f"{type(e).__name__} {e}".lower()
+    return "429" in text or "ratelimit" in text or "rate limit" in text
+
+class ApiBudget:
+    """
+    PRESUPUESTO DE API:
+    Limita las llamadas en vuelo (semáforo) y el ritmo de peticiones (ventana deslizante de 60s).
+    Es seguro entre hilos: todos los nodos comparten la misma instancia.
+    """
+    def __init__(self, max_in_flight=MAX_CONCURRENT_REQUESTS, requests_per_minute=REQUESTS_PER_MINUTE):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.requests_per_minute = max(0, int(requests_per_minute))
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._sent = deque()
+
+    def _wait_for_rate(self):
+        # 0 = sin límite de ritmo
+        if not self.requests_per_minute: return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60.0:
+                    self._sent.popleft()
+                if len(self._sent) < self.requests_per_minute:
+                    self._sent.append(now)
+                    return
+                wait = 60.0 - (now - self._sent[0])
+            time.sleep(max(wait, 0.01))
+
+    @contextmanager
+    def slot(self):
+        """Reserva un hueco de concurrencia y respeta el límite por minuto antes de llamar a la API."""
+        t0 = time.perf_counter()
+        self._slots.acquire()
+        try:
+            self._wait_for_rate()
+            telemetry.observe("api_wait_seconds", time.perf_counter() - t0)
+            yield
+        finally:
+            self._slots.release()
+
+    def call(self, fn, *args, **kwargs):
+        """Ejecuta la llamada dentro de un hueco del presupuesto; ante un 429 espera y reintenta."""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                with self.slot():
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= RATE_LIMIT_RETRIES or not is_rate_limit_error(e): raise
+                wait = RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt)
+                telemetry.count("api_retries")
+                print(f"      ⏳ Límite del proveedor alcanzado. Reintentando en {wait:.0f}s...")
+                time.sleep(wait)
+
+# Instancia global compartida por todos los nodos (y por todas las familias en paralelo)
+api_budget = ApiBudget()
@@ -0,0 +1,113 @@
+import csv
+import re
+from validators import parse_date
+
+# --- CONFIGURACIÓN ---
+# Por debajo de esta confianza el Configurador delega en el Arquitecto AI (LLM)
+MIN_LOCAL_CONFIDENCE = 0.9
+
+ID_HEADERS = {"label", "id", "key", "field", "name", "etiqueta", "campo", "clave", "nombre"}
+VALUE_HEADERS = {"content", "value", "text", "contenido", "valor", "texto", "dato"}
+DROP_HEADERS = {"confidence", "confianza", "score", "status", "estado", "state"}
+STATUS_WORDS = {"approved", "rejected", "pending", "aprobado", "rechazado", "pendiente", "approvato", "aprovado", "ok"}
+
+_CONFIDENCE = re.compile(r"^(0?[.,]\d+|1([.,]0+)?|\d{1,3}([.,]\d+)?\s*%)$")
+_COLON_LINE = re.compile(r"^\s*([^:\t]{1,80}?)\s*:\s*(.*?)\s*$")
+_NUMBER = re.compile(r"^[\s$€£%+\-]*\d[\d.,\s]*%?$")
+
+def infer_rule(value):
+    """Regla de validación por tipo: fechas -> date_match, números -> equals, texto largo -> contains_fuzzy."""
+    val = str(value).strip()
+    # Mismo parser que usa la validación: solo es fecha si date_match podrá compararla
+    if parse_date(val) is not None: return "date_match"
+    if _NUMBER.match(val): return "equals"
+    if len(val.split()) > 6 or len(val) > 40: return "contains_fuzzy"
+    return "equals"
+
+def _is_noise(cell):
+    """Celdas de confianza ('0.98', '97%') o de estado ('Approved')."""
+    c = cell.strip().lower()
+    return bool(_CONFIDENCE.match(c)) or c in STATUS_WORDS
+
+def _rows_to_pairs(rows):
+    """Convierte filas de columnas en pares (ID, valor) descartando confianza y estado."""
+    rows = [[c.strip() for c in r] for r in rows if any(c.strip() for c in r)]
+    if not rows: return []
+
+    header = [c.lower() for c in rows[0]]
+    if any(h in ID_HEADERS | VALUE_HEADERS | DROP_HEADERS for h in header):
+        id_col = next((i for i, h in enumerate(header) if h in ID_HEADERS), 0)
+        value_col = next((i for i, h in enumerate(header) if h in VALUE_HEADERS), None)
+        pairs = []
+        for r in rows[1:]:
+            if len(r) <= id_col: continue
+            if value_col is not None and value_col < len(r):
+                value = r[value_col]
+            else:
+                value = " ".join(c for i, c in enumerate(r) if i != id_col and i < len(header) and header[i] not in DROP_HEADERS)
+            pairs.append((r[id_col], value))
+        return pairs
+
+    # Sin cabecera: primera columna = ID, el resto sin las columnas de ruido = valor.
+    # El ruido se decide por columna (todas sus celdas son confianza o estado), nunca celda a celda:
+    # un valor real como '1', '0.5' u 'OK' no se borra por parecerse a una confianza.
+    width = max(len(r) for r in rows)
+    noise_cols = {
+        j for j in range(1, width)
+        if all(_is_noise(r[j]) for r in rows if len(r) > j and r[j]) and any(len(r) > j and r[j] for r in rows)
+    }
+    pairs = []
+    for r in rows:
+        rest = [c for j, c in enumerate(r[1:], 1) if c and j not in noise_cols]
+        pairs.append((r[0], " ".join(rest)))
+    return pairs
+
+def _split_lines(lines, layout):
+    if layout == "tsv": return [l.split("\t") for l in lines]
+    if layout == "csv": return list(csv.reader(lines))
+    if layout == "fixed": return [re.split(r"\s{2,}", l.strip()) for l in lines]
+    return []
+
+def detect_layout(lines):
+    """Vota el formato más probable: tsv, csv, colon ('ID: valor') o fixed (columnas alineadas)."""
+    n = len(lines)
+    votes = {
+        "tsv": sum(1 for l in lines if "\t" in l),
+        "colon": sum(1 for l in lines if _COLON_LINE.match(l)),
+        "fixed": sum(1 for l in lines if len(re.split(r"\s{2,}", l.strip())) >= 2),
+    }
+    widths = [len(r) for r in csv.reader(lines)]
+    if widths and widths[0] >= 2:
+        votes["csv"] = sum(1 for w in widths if w == widths[0])
+    layout, count = max(votes.items(), key=lambda kv: kv[1])
+    return (layout, count / n) if n else (None, 0.0)
+
+def parse_ground_truth_text(raw_text):
+    """
+    PARSER LOCAL DETERMINISTA:
+    Retorna { "expected_data", "rules", "layout", "confidence" }.
+    confidence = fracción de líneas que encajan en el formato detectado, penalizada si hay IDs vacíos o repetidos.
+    Si algún valor queda vacío la confianza es 0: ese ground truth no es fiable y decide el Arquitecto AI.
+    """
+    lines = [l for l in raw_text.splitlines() if l.strip()]
+    empty = {"expected_data": {}, "rules": {}, "layout": None, "confidence": 0.0}
+    if not lines: return empty
+
+    layout, coverage = detect_layout(lines)
+    if layout == "colon":
+        pairs = [m.groups() for m in (_COLON_LINE.match(l) for l in lines) if m]
+    else:
+        pairs = _rows_to_pairs(_split_lines(lines, layout))
+    if not pairs: return empty
+
+    expected_data, rules = {}, {}
+    for key, value in pairs:
+        clean_key = str(key).strip('"').strip("'").strip()
+        if not clean_key or clean_key in expected_data: continue
+        value = str(value).strip().strip('"')
+        expected_data[clean_key] = {"value": value, "status": "approved"}
+        rules[clean_key] = infer_rule(value)
+
+    valid = sum(1 for k, v in expected_data.items() if v["value"])
+    confidence = coverage * (valid / len(pairs)) if valid == len(expected_data) else 0.0
+    return {"expected_data": expected_data, "rules": rules, "layout": layout, "confidence": round(confidence, 3)}
@@ -1,29 +1,152 @@
-import re, unicodedata, difflib
+import re, unicodedata, json
 from datetime import datetime
+from functools import lru_cache
+from collections import Counter
 import string
 
+# --- NORMALIZADOR PRECOMPILADO ---
+# Se construye una sola vez al importar: tabla de borrado (puntuación + comillas curvas) y regex de meses.
+# Las comillas curvas se unificaban a rectas y luego se borraban con la puntuación: el resultado es el mismo.
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation + "’“”")
+_TEXT_MONTHS = {"AGOSTO": "08", "JULIO": "07", "SETTEMBRE": "09", "SEPTIEMBRE": "09"}
+_TEXT_MONTHS_RE = re.compile("|".join(sorted(_TEXT_MONTHS, key=len, reverse=True)))
+NORMALIZE_CACHE_SIZE = 8192
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_cached(text):
+    # Convertimos a mayúsculas
+    text = text.upper()
+    # TRUCO DE MESES (Ayuda a fechas escritas en validaciones de texto plano) en una sola pasada
+    text = _TEXT_MONTHS_RE.sub(lambda m: _TEXT_MONTHS[m.group(0)], text)
+    # Eliminamos comillas y todos los signos de puntuación (.,-;: etc)
+    text = text.translate(_PUNCTUATION_TABLE)
+    # Normalizamos espacios: Elimina dobles espacios y deja solo uno entre palabras
+    return " ".join(text.split())
+
 def normalize_string(text):
     """
     Normalización base: Mayúsculas, unificación de comillas y limpieza de puntuación.
     IMPORTANTE: Mantiene espacios simples para permitir tokenización (comparar palabras).
+    Memoizada: los valores esperados se repiten en cada intento.
     """
     if not text: return ""
-    # Convertimos a mayúsculas
-    text = str(text).upper()
+    return _normalize_cached(str(text))
+
+# --- PARSER DE FECHAS PRECOMPILADO ---
+# 1. Mapa de Meses Multilingüe
+DATE_MONTHS = {
+    "JANUARY": "01", "ENERO": "01", "GENNAIO": "01", "JANEIRO": "01",
+    "FEBRUARY": "02", "FEBRERO": "02", "FEBBRAIO": "02", "FEVEREIRO": "02",
+    "MARCH": "03", "MARZO": "03", "MARCO": "03",
+    "APRIL": "04", "ABRIL": "04", "APRILE": "04",
+    "MAY": "05", "MAYO": "05", "MAGGIO": "05", "MAIO": "05",
+    "JUNE": "06", "JUNIO": "06", "GIUGNO": "06", "JUNHO": "06",
+    "JULY": "07", "JULIO": "07", "LUGLIO": "07", "JULHO": "07",
+    "AUGUST": "08", "AGOSTO": "08", "AGO": "08",
+    "SEPTEMBER": "09", "SEPTIEMBRE": "09", "SETTEMBRE": "09", "SETEMBRO": "09", "SEP": "09", "SET": "09",
+    "OCTOBER": "10", "OCTUBRE": "10", "OTTOBRE": "10", "OUTUBRO": "10", "OCT": "10",
+    "NOVEMBER": "11", "NOVIEMBRE": "11", "NOVEMBRE": "11", "NOV": "11",
+    "DECEMBER": "12", "DICIEMBRE": "12", "DICEMBRE": "12", "DEZEMBRO": "12", "DIC": "12"
+}
+# Una sola alternancia (la más larga primero) y solo palabras completas: "SET" ya no corrompe "SETUP".
+# Los límites son "no-letra" para que '22OCT2025' siga funcionando.
+_DATE_MONTHS_RE = re.compile(r"(?<![A-Z])(" + "|".join(sorted(DATE_MONTHS, key=len, reverse=True)) + r")(?![A-Z])")
+_NON_DIGITS_RE = re.compile(r"[^0-9]+")
+DATE_CACHE_SIZE = 8192
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date_cached(val_clean):
+    # Quitamos acentos para que 'MARÇO' o 'FÉVRIER' lleguen como letras planas
+    val_clean = "".join(c for c in unicodedata.normalize("NFKD", val_clean) if not unicodedata.combining(c))
+    # Reemplazo de palabras por números en una pasada
+    val_clean = _DATE_MONTHS_RE.sub(lambda m: f" {DATE_MONTHS[m.group(1)]} ", val_clean)
+    # Limpieza de símbolos y conectores ("DE", "OF"...): deja solo números y espacios
+    parts = _NON_DIGITS_RE.sub(" ", val_clean).split()
     
-    # 1. TRUCO DE COMILLAS: Unificar curvas y rectas
-    text = text.replace("’", "'").replace("`", "'").replace("“", '"').replace("”", '"')
+    if len(parts) == 3:
+        # Intentamos adivinar formato: YMD, DMY, MDY
+        try:
+            p1, p2, p3 = int(parts[0]), int(parts[1]), int(parts[2])
+            
+            # Caso ISO: 2025 10 22
+            if p1 > 1900: 
+                return datetime(p1, p2, p3)
+            # Caso Invertido: 22 10 2025
+            if p3 > 1900:
+                return datetime(p3, p2, p1)
+        except: pass
+    return None
+
+def parse_date(val):
+    """Convierte un texto de fecha (cualquier idioma soportado) a datetime, o None si no es una fecha."""
+    if not val: return None
+    return _parse_date_cached(str(val).upper().strip())
+
+def parse_dates(values):
+    """API por lotes: parsea una lista de valores (los repetidos salen de la caché)."""
+    return [parse_date(v) for v in values]
+
+# --- MOTOR DE SIMILITUD (LEVENSHTEIN ACOTADO) ---
+# Si rapidfuzz está instalado, la distancia se calcula en C; si no, usamos el motor bit-paralelo propio.
+try:
+    from rapidfuzz.distance import Levenshtein as _FastLevenshtein
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+def levenshtein_within(a, b, max_dist):
+    """
+    Distancia de edición entre a y b si es <= max_dist; None si la supera.
+    Algoritmo bit-paralelo de Myers/Hyyrö: una columna por carácter con operaciones sobre enteros,
+    con rechazo rápido por diferencia de longitudes y salida anticipada en cuanto el umbral es inalcanzable.
+    """
+    if len(a) < len(b): a, b = b, a
+    if len(a) - len(b) > max_dist: return None
     
-    # 2. TRUCO DE MESES (Ayuda a fechas escritas en validaciones de texto plano)
-    replacements = {"AGOSTO": "08", "JULIO": "07", "SETTEMBRE": "09", "SEPTIEMBRE": "09"} 
-    for mes, num in replacements.items():
-        text = text.replace(mes, num)
-        
-    # Eliminamos todos los signos de puntuación (.,-;: etc)
-    text = text.translate(str.maketrans('', '', string.punctuation))
+    if RAPIDFUZZ_AVAILABLE:
+        dist = _FastLevenshtein.distance(a, b, score_cutoff=max_dist)
+        return dist if dist <= max_dist else None
     
-    # Normalizamos espacios: Elimina dobles espacios y deja solo uno entre palabras
-    return " ".join(text.split())
+    # El prefijo y sufijo comunes no cambian la distancia: los recortamos (textos casi iguales = casi gratis)
+    start, end_a, end_b = 0, len(a), len(b)
+    while start < end_b and a[start] == b[start]: start += 1
+    while end_b > start and a[end_a - 1] == b[end_b - 1]: end_a -= 1; end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    n, m = len(a), len(b)
+    if m == 0: return n if n <= max_dist else None
+    
+    # Cota inferior por multiconjunto de caracteres: lo que no está en ambos textos hay que editarlo sí o sí
+    if n - sum((Counter(a) & Counter(b)).values()) > max_dist: return None
+    
+    peq = {}
+    for i, c in enumerate(b):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    
+    for j, c in enumerate(a):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high: score += 1
+        elif mh & high: score -= 1
+        # La fila inferior baja como mucho 1 por columna restante: si ni así llega, cortamos
+        if score - (n - j - 1) > max_dist: return None
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score if score <= max_dist else None
+
+def similarity_at_least(s1, s2, threshold):
+    """True si 1 - distancia / longitud_mayor >= threshold."""
+    longest = max(len(s1), len(s2))
+    if longest == 0 or threshold <= 0: return True
+    max_dist = int((1 - threshold) * longest + 1e-9)
+    return levenshtein_within(s1, s2, max_dist) is not None
 
 class InfocontrolValidators:
     @staticmethod
@@ -57,9 +180,9 @@ class InfocontrolValidators:
 
     @staticmethod
     def script_percentage_match(extracted, expected, threshold=0.4, **kwargs):
-        """Comparación difusa por porcentaje de similitud (Levenshtein)."""
+        """Comparación difusa por porcentaje de similitud (Levenshtein acotado, ver similarity_at_least)."""
         s1, s2 = str(extracted).upper(), str(expected).upper()
-        return difflib.SequenceMatcher(None, s1, s2).ratio() >= float(threshold)
+        return similarity_at_least(s1, s2, float(threshold))
 
     @staticmethod
     def script_contains(extracted, expected, **kwargs):
@@ -84,56 +207,9 @@ class InfocontrolValidators:
         Entiende: '2025-10-22' == '22 de octubre de 2025' == '22/10/25'
         Soporta: Español, Inglés, Italiano, Portugués.
         """
-        def parse_smart_date(val):
-            if not val: return None
-            val_clean = str(val).upper().strip()
-            
-            # 1. Mapa de Meses Multilingüe
-            months = {
-                "JANUARY": "01", "ENERO": "01", "GENNAIO": "01", "JANEIRO": "01",
-                "FEBRUARY": "02", "FEBRERO": "02", "FEBBRAIO": "02", "FEVEREIRO": "02",
-                "MARCH": "03", "MARZO": "03", "MARCO": "03",
-                "APRIL": "04", "ABRIL": "04", "APRILE": "04",
-                "MAY": "05", "MAYO": "05", "MAGGIO": "05", "MAIO": "05",
-                "JUNE": "06", "JUNIO": "06", "GIUGNO": "06", "JUNHO": "06",
-                "JULY": "07", "JULIO": "07", "LUGLIO": "07", "JULHO": "07",
-                "AUGUST": "08", "AGOSTO": "08", "AGO": "08",
-                "SEPTEMBER": "09", "SEPTIEMBRE": "09", "SETTEMBRE": "09", "SETEMBRO": "09", "SEP": "09", "SET": "09",
-                "OCTOBER": "10", "OCTUBRE": "10", "OTTOBRE": "10", "OUTUBRO": "10", "OCT": "10",
-                "NOVEMBER": "11", "NOVIEMBRE": "11", "NOVEMBRE": "11", "NOV": "11",
-                "DECEMBER": "12", "DICIEMBRE": "12", "DICEMBRE": "12", "DEZEMBRO": "12", "DIC": "12"
-            }
-            
-            # Reemplazo de palabras por números
-            for name, num in months.items():
-                if name in val_clean:
-                    val_clean = val_clean.replace(name, num)
-            
-            # Limpieza de conectores ("DE", "DEL", "OF")
-            val_clean = re.sub(r'\b(DE|DEL|OF|THE)\b', ' ', val_clean)
-            # Limpieza de símbolos (deja solo números y espacios)
-            val_clean = re.sub(r'[^0-9]', ' ', val_clean)
-            
-            # Normalización de espacios
-            parts = val_clean.split()
-            
-            if len(parts) == 3:
-                # Intentamos adivinar formato: YMD, DMY, MDY
-                try:
-                    p1, p2, p3 = int(parts[0]), int(parts[1]), int(parts[2])
-                    
-                    # Caso ISO: 2025 10 22
-                    if p1 > 1900: 
-                        return datetime(p1, p2, p3)
-                    # Caso Invertido: 22 10 2025
-                    if p3 > 1900:
-                        return datetime(p3, p2, p1)
-                except: pass
-            return None
-
         # Intentamos parsear ambas fechas como objetos datetime
-        d1 = parse_smart_date(extracted)
-        d2 = parse_smart_date(expected)
+        d1 = parse_date(extracted)
+        d2 = parse_date(expected)
 
         # Si ambas son fechas válidas, comparamos los objetos (ignora formato texto)
         if d1 and d2:
@@ -142,65 +218,91 @@ class InfocontrolValidators:
         # Si falla el parseo, fallback a comparación de texto normalizada
         return normalize_string(extracted) == normalize_string(expected)
 
-def validate_result(actual, expected, rules):
-    # --- CORRECCIÓN CRÍTICA: ANTI-CRASH /0 ---
-    # Si no hay datos esperados, devolvemos 0.0 inmediatamente y un error claro
-    if not expected:
-        return ["ERROR CRÍTICO: No se encontraron datos esperados contra los cuales validar."], 0.0
-
-    # Validación de estructura básica
-    if not actual or not isinstance(actual, dict): 
-        return ["ERROR: La IA no devolvió un formato JSON válido (Formato de salida inválido)"], 0.0
-    
-    mismatches, correct = [], 0
-    validator = InfocontrolValidators()
+# --- PLAN DE VALIDACIÓN PRECOMPILADO ---
+# Alias que usa el Juez (optimizer_node) para nombrar reglas
+RULE_ALIASES = {"contains_full": "contains_fuzzy", "contains_related": "contains"}
+PLAN_CACHE_SIZE = 64
 
-    for field, exp_obj in expected.items():
-        # 1. Extracción segura del valor REAL
-        act_obj = actual.get(field, {})
-        val_act = str(act_obj.get('value', act_obj)) if isinstance(act_obj, dict) else str(act_obj)
-        
-        # 2. Extracción segura del valor ESPERADO
-        val_exp = str(exp_obj.get('value', ''))
-        
-        # 3. Determinación de la REGLA
-        rule_cfg = rules.get(field, "equals")
-        rule_name = rule_cfg.get("rule", "equals") if isinstance(rule_cfg, dict) else rule_cfg
-        
-        # --- MAPEO INTELIGENTE DE REGLAS DEL JUEZ (ALIASES) ---
-        if rule_name == "contains_full": rule_name = "contains_fuzzy"
-        if rule_name == "contains_related": rule_name = "contains"
-        if "date" in rule_name.lower() or "iso" in rule_name.lower(): 
-            rule_name = "date_match"
-        
-        is_match = False
+def resolve_rule_name(rule_cfg):
+    """Traduce la configuración de regla de un campo (str o {"rule": ...}) a su nombre canónico."""
+    rule_name = rule_cfg.get("rule", "equals") if isinstance(rule_cfg, dict) else rule_cfg
+    rule_name = RULE_ALIASES.get(rule_name, rule_name)
+    if "date" in str(rule_name).lower() or "iso" in str(rule_name).lower(): 
+        rule_name = "date_match"
+    return rule_name
 
-        try:
-            # Intentamos ejecutar el método correspondiente dinámicamente
-            method_name = f"script_{rule_name}"
-            
-            if hasattr(validator, method_name):
-                method = getattr(validator, method_name)
-                if method(val_act, val_exp):
-                    is_match = True
+class ValidationPlan:
+    """
+    Reglas de la familia ya resueltas a comparadores: { campo: (nombre_regla, función) }.
+    Se compila una vez y se reutiliza en todos los casos e intentos; solo cambia si cambian las reglas.
+    """
+    DEFAULT = ("equals", InfocontrolValidators.script_equals)
+
+    def __init__(self, rules):
+        self.comparators = {field: self._compile(cfg) for field, cfg in (rules or {}).items()}
+
+    @staticmethod
+    def _compile(rule_cfg):
+        rule_name = resolve_rule_name(rule_cfg)
+        # Fallback a equals si la regla no existe (pero conservamos el nombre para el log)
+        method = getattr(InfocontrolValidators, f"script_{rule_name}", InfocontrolValidators.script_equals)
+        return rule_name, method
+
+    def evaluate(self, actual, expected):
+        """Retorna [(campo, acierto, valor_esperado, valor_real, regla)] en el orden de expected."""
+        results = []
+        comparators = self.comparators
+        for field, exp_obj in expected.items():
+            # 1. Extracción segura del valor REAL
+            act_obj = actual.get(field, {})
+            val_act = str(act_obj.get('value', act_obj)) if isinstance(act_obj, dict) else str(act_obj)
+            # 2. Extracción segura del valor ESPERADO
+            val_exp = str(exp_obj.get('value', ''))
+            # 3. Comparador ya resuelto
+            rule_name, method = comparators.get(field, self.DEFAULT)
+            try:
+                is_match = bool(method(val_act, val_exp))
+            except Exception as e:
+                print(f"Error validando {field}: {e}")
+                is_match = False
+            results.append((field, is_match, val_exp, val_act, rule_name))
+        return results
+
+    def check(self, actual, expected):
+        """Como validate, pero además retorna { campo: acierto } para la matriz de scores."""
+        # --- CORRECCIÓN CRÍTICA: ANTI-CRASH /0 ---
+        # Si no hay datos esperados, devolvemos 0.0 inmediatamente y un error claro
+        if not expected:
+            return ["ERROR CRÍTICO: No se encontraron datos esperados contra los cuales validar."], 0.0, {}
+
+        # Validación de estructura básica: todos los campos cuentan como fallo
+        if not actual or not isinstance(actual, dict): 
+            return ["ERROR: La IA no devolvió un formato JSON válido (Formato de salida inválido)"], 0.0, {field: False for field in expected}
+
+        mismatches, correct, fields = [], 0, {}
+        for field, is_match, val_exp, val_act, rule_name in self.evaluate(actual, expected):
+            fields[field] = is_match
+            # --- CÁLCULO DE SCORE ---
+            if is_match:
+                correct += 1
             else:
-                # Fallback a equals si la regla no existe
-                if validator.script_equals(val_act, val_exp):
-                    is_match = True
-                    
-        except Exception as e:
-            print(f"Error validando {field}: {e}")
-
-        # --- CÁLCULO DE SCORE ---
-        if is_match:
-            correct += 1
-        else:
-            # LOG DETALLADO
-            mismatches.append(f"ID {field}: Esperado '{val_exp}' vs Real '{val_act}' ({rule_name})")
-            
-    # --- CÁLCULO SEGURO ---
-    total = len(expected)
-    if total > 0:
-        return mismatches, (correct / total) * 100
-    else:
-        return ["ERROR: Archivo de expected vacío"], 0.0
\ No newline at end of file
+                # LOG DETALLADO
+                mismatches.append(f"ID {field}: Esperado '{val_exp}' vs Real '{val_act}' ({rule_name})")
+
+        return mismatches, (correct / len(expected)) * 100, fields
+
+    def validate(self, actual, expected):
+        mismatches, score, _ = self.check(actual, expected)
+        return mismatches, score
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _compile_plan_cached(rules_key):
+    return ValidationPlan(json.loads(rules_key))
+
+def compile_validation_plan(rules):
+    """Devuelve el plan para estas reglas; solo se recompila cuando el dict de reglas cambia."""
+    return _compile_plan_cached(json.dumps(rules or {}, sort_keys=True, default=str))
+
+def validate_result(actual, expected, rules):
+    """Compatibilidad: valida un caso compilando (o reutilizando) el plan de sus reglas."""
+    return compile_validation_plan(rules).validate(actual, expected)